@@ -0,0 +1,78 @@
+"""Importing a zip of monthly statements: one import per file, as users had to do before, against
+import_statement_archive with 1..N parsing processes.
+
+    python -m benchmarks.bench_archive --files 24 --rows 5000 --processes 1 2 4
+
+Each configuration runs in its own process on a fresh database. Parsing only scales with cores
+that are actually there; `nproc` on the machine is printed with the results.
+"""
+import argparse
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+from benchmarks.common import setup_django, make_fixtures, write_monobank_csv
+
+
+def write_archive(path, files, rows):
+    # Consecutive months, newest last in the archive; every statement is `rows` rows, 3 minutes apart
+    from datetime import datetime, timedelta
+
+    with tempfile.TemporaryDirectory() as tmp, zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for month in range(files):
+            newest = datetime(2024, 1, 1) + timedelta(minutes=3 * rows * (month + 1))
+            statement = write_monobank_csv(os.path.join(tmp, f'{month:03}.csv'), rows, newest=newest)
+            archive.write(statement, f'statement-{month:03}.csv')
+    return path
+
+
+def run_one(path, mode):
+    setup_django()
+    from django.conf import settings
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from finances.archives import import_statement_archive
+    from finances.tasks import import_transaction_file
+
+    user, balance = make_fixtures()
+    started = time.perf_counter()
+    if mode == 'one by one':
+        inserted = 0
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                upload = SimpleUploadedFile(info.filename, archive.read(info))
+                inserted += import_transaction_file(upload, user, balance)['inserted']
+    else:
+        settings.IMPORT_PROCESSES = int(mode)
+        with open(path, 'rb') as f:
+            inserted = import_statement_archive(io.BytesIO(f.read()), user, balance)['inserted']
+    elapsed = time.perf_counter() - started
+    label = mode if mode == 'one by one' else f'archive, {mode} proc'
+    print(f"{label:>18} {inserted:>9} {elapsed:>9.2f} {inserted / elapsed:>9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=24)
+    parser.add_argument('--rows', type=int, default=5000, help="rows per statement")
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--single', nargs=2, metavar=('PATH', 'MODE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        run_one(*args.single)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_archive(os.path.join(tmp, 'statements.zip'), args.files, args.rows)
+        print(f"{args.files} statements x {args.rows} rows, {os.cpu_count()} CPUs")
+        print(f"{'mode':>18} {'rows':>9} {'seconds':>9} {'rows/s':>9}")
+        for mode in ['one by one'] + [str(processes) for processes in args.processes]:
+            subprocess.run([sys.executable, '-m', 'benchmarks.bench_archive', '--single', path, mode], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Commits and wall-clock time per ingestion: a file import and a Monobank sync, with and without
+the surrounding transaction, and with SQLite's default journal against WAL + synchronous=NORMAL.
+
+    python -m benchmarks.bench_commits --rows 20000 --sync-rows 2000
+
+'autocommit' swaps the ingestion paths' atomic() for a no-op, which is how they used to run:
+every statement its own commit. Each configuration runs in its own process on a fresh database.
+"""
+import argparse
+import contextlib
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from unittest.mock import Mock, patch
+
+from benchmarks.common import setup_django, make_fixtures, write_monobank_csv
+
+CONFIGS = {
+    # name: (atomic ingestion, settings PRAGMAs)
+    'autocommit, rollback journal': (False, False),
+    'atomic, rollback journal': (True, False),
+    'atomic, WAL': (True, True),
+}
+
+
+@contextlib.contextmanager
+def count_commits():
+    # Explicit commits (the end of an outermost atomic block) plus every write that ran in
+    # autocommit mode, which SQLite commits on its own
+    from django.db import connection
+
+    counts = {'commits': 0}
+
+    def wrapper(execute, sql, params, many, context):
+        if not connection.in_atomic_block and not sql.lstrip().upper().startswith(('SELECT', 'PRAGMA')):
+            counts['commits'] += 1
+        return execute(sql, params, many, context)
+
+    commit = connection.commit
+
+    def counted_commit():
+        counts['commits'] += 1
+        commit()
+
+    connection.ensure_connection()
+    with patch.object(connection, 'commit', counted_commit), connection.execute_wrapper(wrapper):
+        yield counts
+
+
+def sync_response(rows):
+    return Mock(ok=True, json=Mock(return_value=[
+        {"id": str(i), "time": 1765000000 - 60 * i, "description": f"Purchase {i % 500}", "mcc": 5411,
+         "amount": -((i * 37) % 5000) - 1}
+        for i in range(rows)
+    ]))
+
+
+def run_one(config, rows, sync_rows):
+    atomic, pragmas = CONFIGS[config]
+    setup_django(db_options=None if pragmas else {})
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.db import connection
+    from finances.tasks import import_transaction_file
+    from monobank.models import MonobankBalance, MonobankUser
+    from monobank.views import fetch_monobank_report
+
+    user, balance = make_fixtures()
+    monobank_user = MonobankUser.objects.create(user=user, token='benchmark')
+    MonobankBalance.objects.create(balance=balance, currency=balance.currency, name='black', user=monobank_user,
+                                   monobank_id='acc', amount=0)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_monobank_csv(os.path.join(tmp, 'statement.csv'), rows)
+        with open(path, 'rb') as f:
+            upload = SimpleUploadedFile('statement.csv', f.read())
+
+    with connection.cursor() as cursor:
+        journal = cursor.execute('PRAGMA journal_mode').fetchone()[0]
+
+    no_atomic = contextlib.ExitStack()
+    if not atomic:
+        no_atomic.enter_context(patch('finances.tasks.atomic', contextlib.nullcontext))
+        no_atomic.enter_context(patch('monobank.views.atomic', contextlib.nullcontext))
+
+    results = []
+    with no_atomic:
+        with count_commits() as counts:
+            started = time.perf_counter()
+            import_transaction_file(upload, user, balance)
+            results.append((rows, counts['commits'], time.perf_counter() - started))
+
+        with patch('finances.http_client.get', return_value=sync_response(sync_rows)), \
+                count_commits() as counts:
+            started = time.perf_counter()
+            fetch_monobank_report('benchmark', 'acc', 0, user, adjust_balance=True)
+            results.append((sync_rows, counts['commits'], time.perf_counter() - started))
+
+    for (label, (count, commits, elapsed)) in zip(['file import', 'monobank sync'], results):
+        print(f"{config:>30} {journal:>8} {label:>14} {count:>7} {commits:>8} {elapsed:>9.2f} {count / elapsed:>9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20_000, help="rows in the imported statement")
+    parser.add_argument('--sync-rows', type=int, default=2_000, help="rows in the Monobank sync")
+    parser.add_argument('--single', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        run_one(args.single, args.rows, args.sync_rows)
+        return
+
+    print(f"{'configuration':>30} {'journal':>8} {'path':>14} {'rows':>7} {'commits':>8} {'seconds':>9} {'rows/s':>9}")
+    for config in CONFIGS:
+        subprocess.run([sys.executable, '-m', 'benchmarks.bench_commits', '--single', config,
+                        '--rows', str(args.rows), '--sync-rows', str(args.sync_rows)], check=True)
+
+
+if __name__ == '__main__':
+    main()
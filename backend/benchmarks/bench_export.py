@@ -0,0 +1,66 @@
+"""Memory of the streaming export as the ledger grows, against a serializer dump.
+
+    python -m benchmarks.bench_export --rows 1000000
+
+The ledger is grown in steps; after each one the whole export is consumed the way a server
+would, chunk by chunk. Peak traced memory should stay flat, and the process peak RSS should
+not grow with the row count.
+"""
+import argparse
+import resource
+import time
+
+from benchmarks.common import setup_django, make_fixtures, bulk_transactions, peak_memory
+
+
+def consume(response):
+    size = 0
+    for chunk in response.streaming_content:
+        size += len(chunk)
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--naive-limit', type=int, default=100_000,
+                        help="largest ledger to also dump through TransactionSerializer(many=True)")
+    args = parser.parse_args()
+
+    setup_django()
+    from rest_framework.test import APIClient
+    from finances.models import Transaction
+    from finances.serializers import TransactionSerializer
+
+    user, balance = make_fixtures()
+    client = APIClient()
+    client.force_authenticate(user=user)
+    url = f'/balance/{balance.id}/transactions/export/'
+
+    steps = sorted({size for size in [10_000, 100_000, args.rows // 2, args.rows] if 0 < size <= args.rows})
+    print(f"{'rows':>10} {'format':>7} {'seconds':>8} {'MiB out':>8} {'peak MiB':>9} {'max RSS MiB':>12} "
+          f"{'serializer peak MiB':>20}")
+    existing = 0
+    for size in steps:
+        bulk_transactions(user, balance, size - existing, offset=existing)
+        existing = size
+
+        naive = ''
+        if size <= args.naive_limit:
+            with peak_memory() as naive_memory:
+                TransactionSerializer(Transaction.objects.filter(balance=balance), many=True).data
+            naive = f"{naive_memory['peak_mib']:.1f}"
+
+        for file_format in ['csv', 'ndjson']:
+            started = time.perf_counter()
+            written = consume(client.get(url, {'file_format': file_format}))
+            elapsed = time.perf_counter() - started
+            with peak_memory() as memory:
+                consume(client.get(url, {'file_format': file_format}))
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            print(f"{size:>10} {file_format:>7} {elapsed:>8.2f} {written / 2 ** 20:>8.1f} "
+                  f"{memory['peak_mib']:>9.2f} {max_rss:>12.1f} {naive:>20}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Throughput and peak memory of import_transaction_file on synthetic Monobank statements.
+
+    python -m benchmarks.bench_import --sizes 10000 100000 1000000
+
+Every size runs in its own process so that the peak RSS it reports belongs to that import alone.
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import setup_django, make_fixtures, write_monobank_csv
+
+
+def max_rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_one(rows, chunk_size, reimport):
+    setup_django()
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from finances.models import Transaction
+    from finances.tasks import IMPORT_CHUNK_SIZE, import_transaction_file
+
+    user, balance = make_fixtures()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_monobank_csv(os.path.join(tmp, 'statement.csv'), rows)
+        with open(path, 'rb') as f:
+            upload = SimpleUploadedFile('statement.csv', f.read())
+        size_mib = os.path.getsize(path) / 2 ** 20
+
+    baseline = max_rss_mib()
+    started = time.perf_counter()
+    import_transaction_file(upload, user, balance, chunk_size=chunk_size or IMPORT_CHUNK_SIZE)
+    elapsed = time.perf_counter() - started
+    assert Transaction.objects.filter(balance=balance).count() == rows
+
+    line = f"{rows:>10} {size_mib:>8.1f} {elapsed:>9.2f} {rows / elapsed:>10.0f} {max_rss_mib() - baseline:>15.1f}"
+
+    if reimport:
+        upload.seek(0)
+        started = time.perf_counter()
+        result = import_transaction_file(upload, user, balance, chunk_size=chunk_size or IMPORT_CHUNK_SIZE)
+        assert result['skipped'] == rows
+        line += f" {time.perf_counter() - started:>13.2f}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--chunk-size', type=int, help="rows per chunk, defaults to IMPORT_CHUNK_SIZE")
+    parser.add_argument('--reimport', action='store_true', help="also time importing the same file again")
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        run_one(args.single, args.chunk_size, args.reimport)
+        return
+
+    print(f"{'rows':>10} {'file MiB':>8} {'seconds':>9} {'rows/s':>10} {'peak RSS +MiB':>15}"
+          + (f" {'reimport s':>13}" if args.reimport else ''))
+    for rows in args.sizes:
+        command = [sys.executable, '-m', 'benchmarks.bench_import', '--single', str(rows)]
+        if args.chunk_size:
+            command += ['--chunk-size', str(args.chunk_size)]
+        if args.reimport:
+            command.append('--reimport')
+        subprocess.run(command, check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Page-number vs cursor paging over a large ledger.
+
+    python -m benchmarks.bench_pagination --rows 200000
+"""
+import argparse
+
+from benchmarks.common import setup_django, make_fixtures, bulk_transactions, get_ok, timed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--page-size', type=int, default=50)
+    args = parser.parse_args()
+
+    setup_django()
+    from rest_framework.test import APIClient
+    from finances.models import Transaction
+    from finances.pagination import encode_cursor
+
+    user, balance = make_fixtures()
+    bulk_transactions(user, balance, args.rows)
+
+    client = APIClient()
+    client.force_authenticate(user=user)
+    url = f'/balance/{balance.id}/transactions/'
+    ordered = Transaction.objects.filter(balance=balance).order_by('-date', '-id')
+
+    print(f"{args.rows} rows, page size {args.page_size}")
+    print(f"{'depth':>10} {'page-number ms':>16} {'cursor ms':>12}")
+    last_page = args.rows // args.page_size
+    for page in sorted({p for p in (1, 10, 100, 1000, last_page // 2, last_page) if 1 <= p <= last_page}):
+        offset = (page - 1) * args.page_size
+        params = {'sort_by': 'date', 'order': 'desc', 'page_size': args.page_size}
+
+        page_number = timed(lambda: get_ok(client, url, {**params, 'page': page}))
+
+        cursor = ''
+        if offset:
+            previous = ordered[offset - 1]
+            cursor = encode_cursor(previous.date, previous.pk)
+        keyset = timed(lambda: get_ok(client, url, {**params, 'cursor': cursor}))
+
+        print(f"{offset:>10} {page_number * 1000:>16.2f} {keyset * 1000:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
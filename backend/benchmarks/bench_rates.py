@@ -0,0 +1,111 @@
+"""Exchange-rate refreshes, queries and wall-clock time per refresh: fetch_crypto_rates against the
+recorded CoinGecko response in tests/coingecko_response.json, and fetch_exchange_rates against a
+Monobank-shaped response quoting every ISO 4217 currency. Each is compared with the per-row loop
+it replaced.
+
+    python -m benchmarks.bench_rates --repeat 20
+
+The HTTP call is patched out, so only the database side is measured. Every refresh after the
+first updates rows that already exist, which is what a scheduled refresh mostly does.
+"""
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+from benchmarks.common import setup_django
+
+FIXTURE = Path(__file__).resolve().parent.parent / 'tests' / 'coingecko_response.json'
+
+
+def per_coin_refresh(coins):
+    # The refresh as it used to be: a get and an update_or_create on every field per coin
+    from django.db.transaction import atomic
+    from finances.models import Currency
+    from finances.rates import bump_version, record_history
+
+    with atomic():
+        uah, _ = Currency.objects.update_or_create(num_code=980, alpha_code='UAH', name='Hryvnia', rate=1)
+        fetched = {uah.pk: 1}
+        for coin in coins:
+            id_val = coin["id"]
+            alpha_code = coin["symbol"].upper()
+            try:
+                existing = Currency.objects.get(id=alpha_code)
+                if existing.name == coin["name"]:
+                    id_val = alpha_code
+            except Currency.DoesNotExist:
+                id_val = alpha_code
+            currency, _ = Currency.objects.update_or_create(num_code=None, alpha_code=alpha_code, name=coin["name"],
+                                                            rate=coin["current_price"], id=id_val)
+            fetched[currency.pk] = coin["current_price"]
+        record_history(fetched)
+    bump_version()
+
+
+def per_row_fiat_refresh(rates):
+    # The Monobank refresh as it used to be: a pycountry lookup and an update_or_create per rate
+    import pycountry
+    from django.db.transaction import atomic
+    from finances.models import Currency
+    from finances.rates import bump_version, record_history
+
+    with atomic():
+        uah, _ = Currency.objects.update_or_create(num_code="980", id="UAH", name="Hryvnia", rate=1)
+        fetched = {uah.pk: 1}
+        for rate in rates:
+            currency_object = pycountry.currencies.get(numeric=f"{rate['currencyCodeA']:03}")
+            currency, _ = Currency.objects.update_or_create(
+                num_code=rate["currencyCodeA"], id=currency_object.alpha_3, name=currency_object.name,
+                defaults={"rate": rate["rateCross"]})
+            fetched[currency.pk] = rate["rateCross"]
+        record_history(fetched)
+    bump_version()
+
+
+def measure(refresh, repeat):
+    from django.db import connection
+
+    samples = []
+    for _ in range(repeat):
+        queries = []
+        with connection.execute_wrapper(lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)):
+            started = time.perf_counter()
+            refresh()
+            samples.append(time.perf_counter() - started)
+    samples.sort()
+    return len(queries), samples[len(samples) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ['COINGECKO_API_KEY'] = 'benchmark'
+    setup_django()
+    from finances.currencies import HRYVNIA, iso_currencies
+    from finances.models import Currency
+    from finances.tasks import fetch_crypto_rates, fetch_exchange_rates
+
+    coins = json.loads(FIXTURE.read_text())
+    rates = [{"currencyCodeA": code, "currencyCodeB": HRYVNIA, "rateCross": 1 + code / 100}
+             for code in iso_currencies() if code != HRYVNIA]
+    runs = [
+        ('crypto', 'per coin', coins, lambda: per_coin_refresh(coins)),
+        ('crypto', 'upsert', coins, fetch_crypto_rates),
+        ('fiat', 'per row', rates, lambda: per_row_fiat_refresh(rates)),
+        ('fiat', 'upsert', rates, fetch_exchange_rates),
+    ]
+    print(f"{len(coins)} coins, {len(rates)} fiat rates, median of {args.repeat} refreshes")
+    print(f"{'refresh':>18} {'queries':>8} {'ms':>8}")
+    for kind, label, payload, refresh in runs:
+        Currency.objects.all().delete()
+        with patch('finances.http_client.get', return_value=Mock(json=Mock(return_value=payload))):
+            queries, seconds = measure(refresh, args.repeat)
+        print(f"{kind + ', ' + label:>18} {queries:>8} {seconds * 1000:>8.1f}")
+
+if __name__ == '__main__':
+    main()
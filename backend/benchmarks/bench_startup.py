@@ -0,0 +1,76 @@
+"""What a fresh worker pays before serving its first request: django.setup() plus loading the
+URLconf (and with it every view module), and the memory that import leaves behind.
+
+    python -m benchmarks.bench_startup --runs 10
+
+Each run is a new interpreter, so nothing is warm but the OS page cache.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+def child(trace):
+    import resource
+    import time
+    import tracemalloc
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'finance_manager.settings')
+    os.environ.setdefault('DJANGO_SECRET_KEY', 'benchmark')
+    if trace:
+        # Tracing slows imports down a lot, so traced runs only count memory
+        tracemalloc.start()
+    started = time.perf_counter()
+
+    import django
+    django.setup()
+    setup = time.perf_counter() - started
+
+    from django.urls import get_resolver
+    get_resolver().resolve('/balance/')
+    total = time.perf_counter() - started
+
+    print(json.dumps({
+        'setup': setup,
+        'total': total,
+        'traced_mib': tracemalloc.get_traced_memory()[0] / 2 ** 20 if trace else None,
+        'rss_mib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'heavy': sorted(name for name in ('pandas', 'numpy', 'pycountry') if name in sys.modules),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--trace', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.trace)
+        return
+
+    def run(*flags):
+        output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_startup', '--child', *flags],
+                                check=True, capture_output=True, text=True).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    results = [run() for _ in range(args.runs)]
+    traced = run('--trace')
+
+    def median(key):
+        return statistics.median(result[key] for result in results)
+
+    print(f"{args.runs} fresh interpreters, medians")
+    print(f"  django.setup()           {median('setup') * 1000:8.1f} ms")
+    print(f"  setup + URL resolution   {median('total') * 1000:8.1f} ms")
+    print(f"  traced import memory     {traced['traced_mib']:8.1f} MiB")
+    print(f"  peak RSS                 {median('rss_mib'):8.1f} MiB")
+    print(f"  heavy modules loaded     {', '.join(results[0]['heavy']) or 'none'}")
+
+
+if __name__ == '__main__':
+    main()
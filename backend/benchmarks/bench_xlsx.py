@@ -0,0 +1,66 @@
+"""PrivatBank XLSX import: the streaming openpyxl reader against the old pd.read_excel path.
+
+    python -m benchmarks.bench_xlsx --rows 100000
+
+Each reader runs in its own process on the same synthetic workbook so that the peak RSS it
+reports is its own.
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import setup_django, make_fixtures, write_privatbank_xlsx
+
+
+def read_excel_whole(parser, file_obj, chunk_size):
+    # The reader import_transaction_file used before: the whole workbook through pandas, then sliced
+    import pandas as pd
+
+    df = pd.read_excel(file_obj, header=1)
+    for start in range(0, max(len(df), 1), chunk_size):
+        yield df.iloc[start:start + chunk_size].copy()
+
+
+def run_one(path, reader):
+    setup_django()
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from finances import parsers, tasks
+
+    if reader == 'read_excel':
+        parsers.PrivatBankXLSX.read_chunks = read_excel_whole
+    user, balance = make_fixtures()
+    with open(path, 'rb') as f:
+        upload = SimpleUploadedFile('statement.xlsx', f.read())
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    started = time.perf_counter()
+    result = tasks.import_transaction_file(upload, user, balance)
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - baseline
+    print(f"{reader:>12} {result['inserted']:>9} {elapsed:>9.2f} {result['inserted'] / elapsed:>9.0f} {peak:>15.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--single', nargs=2, metavar=('PATH', 'READER'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        run_one(*args.single)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_privatbank_xlsx(os.path.join(tmp, 'statement.xlsx'), args.rows)
+        print(f"{args.rows} rows, {os.path.getsize(path) / 2 ** 20:.1f} MiB workbook")
+        print(f"{'reader':>12} {'rows':>9} {'seconds':>9} {'rows/s':>9} {'peak RSS +MiB':>15}")
+        for reader in ['read_excel', 'openpyxl']:
+            subprocess.run([sys.executable, '-m', 'benchmarks.bench_xlsx', '--single', path, reader], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import atexit
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+def setup_django(db_path=None, db_options=None):
+    # Benchmarks run against a throwaway SQLite file so they never touch db.sqlite3.
+    # db_options replaces the database OPTIONS from settings, e.g. {} for SQLite's defaults
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'finance_manager.settings')
+    os.environ.setdefault('DJANGO_SECRET_KEY', 'benchmark')
+
+    import django
+    from django.conf import settings
+
+    if db_path is None:
+        db_path = tempfile.NamedTemporaryFile(prefix='bench-', suffix='.sqlite3', delete=False).name
+        atexit.register(os.remove, db_path)
+    settings.DATABASES['default']['NAME'] = db_path
+    if db_options is not None:
+        settings.DATABASES['default']['OPTIONS'] = db_options
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    settings.DEBUG = False
+    settings.ALLOWED_HOSTS = ['testserver']
+    django.setup()
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+    return db_path
+
+
+def make_fixtures(username='bench'):
+    from django.contrib.auth.models import User
+    from finances.models import Balance, Currency
+
+    user = User.objects.create_user(username=username, password='benchmark')
+    currency, _ = Currency.objects.get_or_create(id='UAH', defaults={'alpha_code': 'UAH', 'num_code': 980,
+                                                                      'name': 'Hryvnia', 'rate': 1})
+    balance = Balance.objects.create(user=user, amount=0, currency=currency, name='Benchmark')
+    return user, balance
+
+
+def bulk_transactions(user, balance, rows, batch_size=5000, offset=0):
+    # Synthetic ledger: one transaction a minute going back in time, amounts repeating so that
+    # sorting by amount has plenty of ties. `offset` continues an existing ledger further back
+    from datetime import timedelta
+    from decimal import Decimal
+    from django.utils import timezone
+    from finances.models import Transaction
+
+    now = timezone.now()
+    for start in range(offset, offset + rows, batch_size):
+        Transaction.objects.bulk_create([
+            Transaction(user=user, balance=balance, name=f'Row {i}', category='Other',
+                        amount=Decimal((i % 2000) - 1000), amount_uah=Decimal((i % 2000) - 1000),
+                        date=now - timedelta(minutes=i))
+            for i in range(start, min(start + batch_size, offset + rows))
+        ])
+
+
+def get_ok(client, url, params=None):
+    response = client.get(url, params)
+    assert response.status_code == 200, (response.status_code, url)
+    return response
+
+
+def timed(fn, repeat=5):
+    # Median wall-clock seconds over `repeat` runs
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+@contextmanager
+def peak_memory():
+    # Yields a dict that holds the traced peak (in MiB) once the block exits
+    result = {}
+    tracemalloc.start()
+    try:
+        yield result
+    finally:
+        result['peak_mib'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+
+MONOBANK_HEADER = ('"Date and time",Description,MCC,"Card currency amount, (UAH)","Operation amount",'
+                   '"Operation currency","Exchange rate","Commission, (UAH)","Cashback amount, (UAH)",Balance\n')
+MCC_CODES = ['5411', '4121', '5812', '7372', '4829', '5912', '6011', '5999']
+
+
+def write_monobank_csv(path, rows, newest=None, balance=1_000_000.0):
+    # Synthetic statement in the Monobank export layout, newest row first like the real thing
+    from datetime import datetime, timedelta
+
+    newest = newest or datetime(2025, 12, 31, 23, 59)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(MONOBANK_HEADER)
+        for i in range(rows):
+            amount = -((i * 37) % 5000) / 10 if i % 7 else 1500.0
+            date = (newest - timedelta(minutes=3 * i)).strftime('%d.%m.%Y %H:%M:%S')
+            f.write(f'"{date}","Purchase {i % 500}",{MCC_CODES[i % len(MCC_CODES)]},{amount:.2f},{amount:.2f},'
+                    f'UAH,—,—,—,{balance:.2f}\n')
+            balance -= amount
+    return path
+
+
+PRIVATBANK_HEADER = ['Дата', 'Категорія', 'Картка', 'Опис операції', 'Сума в валюті картки', 'Валюта картки',
+                     'Сума в валюті транзакції', 'Валюта транзакції', 'Залишок на кінець періоду', 'Валюта залишку']
+PRIVATBANK_CATEGORIES = ['Супермаркети та продукти', 'Таксі', 'Кафе, бари, ресторани', 'Переказ на свою картку',
+                         'Інше']
+
+
+def write_privatbank_xlsx(path, rows):
+    # Synthetic statement in the PrivatBank export layout: a title line, the header, then rows newest first
+    from datetime import datetime, timedelta
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(['Виписка з Ваших карток за період'])
+    sheet.append(PRIVATBANK_HEADER)
+    newest = datetime(2025, 12, 31, 23, 59)
+    balance = 1_000_000.0
+    for i in range(rows):
+        amount = -((i * 37) % 5000) / 10 if i % 7 else 1500.0
+        date = (newest - timedelta(minutes=3 * i)).strftime('%d.%m.%Y %H:%M:%S')
+        sheet.append([date, PRIVATBANK_CATEGORIES[i % len(PRIVATBANK_CATEGORIES)], '5168 **** **** 1234',
+                      f'Purchase {i % 500}', amount, 'UAH', amount, 'UAH', balance, 'UAH'])
+        balance -= amount
+    workbook.save(path)
+    return path
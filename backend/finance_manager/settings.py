@@ -105,6 +105,26 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # WAL lets readers carry on while an import writes, and with it synchronous=NORMAL only
+        # fsyncs at checkpoints rather than on every commit. IMMEDIATE takes the write lock when
+        # a transaction starts, so import threads queue on busy_timeout instead of failing to upgrade.
+        # Imports commit a chunk at a time, so no writer waits on them for more than a chunk
+        'OPTIONS': {
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+    }
+}
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Shared between worker processes, which is how they learn about exchange-rate refreshes
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('DJANGO_CACHE_DIR', BASE_DIR / '.cache'),
     }
 }
 
@@ -143,6 +163,35 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+# Uploaded statements wait here until an import worker picks them up
+MEDIA_ROOT = os.environ.get('DJANGO_MEDIA_ROOT', BASE_DIR / 'media')
+
+# Threads per web process that run imports in the background. With 0, jobs wait for
+# `manage.py run_import_worker` instead
+IMPORT_WORKER_THREADS = int(os.environ.get('IMPORT_WORKER_THREADS', 2))
+# Seconds those threads sleep between looks at the queue when nothing woke them; a job left
+# running for IMPORT_JOB_TIMEOUT seconds is presumed abandoned by a dead process and run again
+IMPORT_POLL_INTERVAL = float(os.environ.get('IMPORT_POLL_INTERVAL', 30))
+IMPORT_JOB_TIMEOUT = int(os.environ.get('IMPORT_JOB_TIMEOUT', 3600))
+
+# Processes that parse the statements of an uploaded zip side by side; 0 uses every core
+IMPORT_PROCESSES = int(os.environ.get('IMPORT_PROCESSES', 0)) or os.cpu_count() or 1
+
+# Exchange rates older than this many seconds are refreshed: on that cadence by
+# `manage.py refresh_rates`, and in a background thread when a read finds them stale
+RATES_MAX_AGE = int(os.environ.get('RATES_MAX_AGE', 3600))
+RATES_BACKGROUND_REFRESH = os.environ.get('RATES_BACKGROUND_REFRESH', '1') != '0'
+# Only one refresh runs at a time across all processes, for at most RATES_REFRESH_TIMEOUT seconds,
+# and refreshes triggered by requests start no more often than every RATES_MIN_REFRESH_INTERVAL
+RATES_REFRESH_TIMEOUT = int(os.environ.get('RATES_REFRESH_TIMEOUT', 300))
+RATES_MIN_REFRESH_INTERVAL = int(os.environ.get('RATES_MIN_REFRESH_INTERVAL', 60))
+# A refresh request that finds one running waits this many seconds for it, then answers 202
+RATES_REFRESH_WAIT = int(os.environ.get('RATES_REFRESH_WAIT', 5))
+
+# Upstream APIs, called through finances.http_client; tests point these at a local fake server
+MONOBANK_API_URL = os.environ.get('MONOBANK_API_URL', 'https://api.monobank.ua')
+COINGECKO_API_URL = os.environ.get('COINGECKO_API_URL', 'https://api.coingecko.com/api/v3')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -1,6 +1,11 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
 
 
 class FinancesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'finances'
+
+    def ready(self):
+        from finances.jobs import start_workers
+        request_started.connect(start_workers, dispatch_uid='finances.start_import_workers')
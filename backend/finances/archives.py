@@ -0,0 +1,137 @@
+import io
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import django
+from django.conf import settings
+
+from finances.models import Transaction
+from finances.parsers import detect_parser
+from finances.tasks import IMPORT_CHUNK_SIZE, InsertedRows, insert_chunk, read_transactions, settle_snapshots
+
+# Uncompressed bytes an archive may expand to; it is read into memory to be parsed
+ARCHIVE_MAX_SIZE = 512 * 2 ** 20
+
+
+def statement_members(archive):
+    # Files in the archive, minus directories and what macOS and Windows leave behind
+    return [
+        info for info in archive.infolist()
+        if not info.is_dir() and not info.filename.startswith('__MACOSX/')
+        and not info.filename.rsplit('/', 1)[-1].startswith('.')
+    ]
+
+
+def recognised_statements(file_obj):
+    # Names of the members a parser would take, from the first SNIFF_BYTES of each; [] if this is
+    # not a zip at all
+    position = file_obj.tell()
+    try:
+        with zipfile.ZipFile(file_obj) as archive:
+            names = []
+            for info in statement_members(archive):
+                with archive.open(info) as member:
+                    if detect_parser(member) is not None:
+                        names.append(info.filename)
+            return names
+    except zipfile.BadZipFile:
+        return []
+    finally:
+        file_obj.seek(position)
+
+
+def parse_statement(name, data, user, balance):
+    # Runs in a pool process: parses one statement without touching the database
+    file_obj = io.BytesIO(data)
+    file_obj.name = name
+    result = {'name': name, 'parser': None, 'parsed': 0, 'transactions': [], 'latest_balance': None,
+              'error': ''}
+    try:
+        parser = detect_parser(file_obj)
+        result['parser'] = parser and parser.name
+        for parsed, transactions, first_balance in read_transactions(file_obj, user, balance):
+            result['parsed'] += parsed
+            if transactions and not result['transactions']:
+                result['latest_balance'] = first_balance
+            # Sent back as plain tuples: much cheaper to pickle than model instances
+            result['transactions'].extend(
+                (t.date, t.amount, t.name, t.category, t.fingerprint) for t in transactions)
+    except Exception as e:
+        result['error'] = str(e) or e.__class__.__name__
+        result['transactions'] = []
+    return result
+
+
+def parse_statements(statements, user, balance):
+    # Each statement is parsed in its own process, so parsing scales with the cores available.
+    # Spawned rather than forked: the parent may be a threaded web server
+    workers = min(len(statements), settings.IMPORT_PROCESSES)
+    if workers <= 1:
+        return [parse_statement(name, data, user, balance) for name, data in statements]
+    with ProcessPoolExecutor(workers, mp_context=get_context('spawn'), initializer=django.setup) as pool:
+        return list(pool.map(parse_statement, *zip(*statements), [user] * len(statements),
+                             [balance] * len(statements)))
+
+
+def import_statement_archive(file_obj, user, balance, progress=None):
+    # Imports every statement in a zip in one go: they are parsed in parallel, merged and
+    # de-duplicated, then written in bulk, a transaction per IMPORT_CHUNK_SIZE rows. Returns the
+    # usual totals plus per-file stats under 'files'
+    with zipfile.ZipFile(file_obj) as archive:
+        members = statement_members(archive)
+        if sum(info.file_size for info in members) > ARCHIVE_MAX_SIZE:
+            raise ValueError("Archive is too large")
+        statements = [(info.filename, archive.read(info)) for info in members]
+    if not statements:
+        raise ValueError("Archive is empty")
+
+    results = parse_statements(statements, user, balance)
+    if all(result['error'] for result in results):
+        raise ValueError("; ".join(f"{result['name']}: {result['error']}" for result in results))
+    parsed = sum(result['parsed'] for result in results)
+    if progress: progress(parsed, 0)
+
+    # Fingerprints are computed per file, so a row that shows up in two overlapping statements
+    # is the same row; the first file to have it owns it
+    merged = {}
+    for index, result in enumerate(results):
+        for date, amount, name, category, fingerprint in result['transactions']:
+            if fingerprint not in merged:
+                merged[fingerprint] = (index, Transaction(date=date, amount=amount, name=name, category=category,
+                                                          user_id=user.pk, balance_id=balance.pk,
+                                                          fingerprint=fingerprint))
+
+    # Statements are newest first; the file with the newest row decides the running balance
+    latest = max((result for result in results if result['transactions']),
+                 key=lambda result: result['transactions'][0][0], default=None)
+
+    inserted = InsertedRows()
+    owners = [0] * len(results)
+    if latest is not None:
+        # Newest first like a statement, so each chunk checks a narrow date range for duplicates
+        rows = sorted(merged.values(), key=lambda item: item[1].date, reverse=True)
+        for start in range(0, len(rows), IMPORT_CHUNK_SIZE):
+            chunk = rows[start:start + IMPORT_CHUNK_SIZE]
+            new = insert_chunk(balance, [transaction for _, transaction in chunk], inserted,
+                               latest['latest_balance'], latest['transactions'][0][0])
+            new_fingerprints = {t.fingerprint for t in new}
+            for index, transaction in chunk:
+                if transaction.fingerprint in new_fingerprints:
+                    owners[index] += 1
+            if progress: progress(parsed, inserted.count)
+        settle_snapshots(balance, inserted)
+
+    files = []
+    for result, count in zip(results, owners):
+        files.append({
+            'name': result['name'],
+            'parser': result['parser'],
+            'parsed': result['parsed'],
+            'inserted': count,
+            'skipped': len(result['transactions']) - count,
+            'error': result['error'],
+        })
+    if progress: progress(parsed, inserted.count)
+    return {"status": "success", "count": inserted.count, "parsed": parsed, "inserted": inserted.count,
+            "skipped": sum(file['skipped'] for file in files), "files": files}
@@ -0,0 +1,185 @@
+import json
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+# Bank category names (PrivatBank exports) to the MCC they stand for
+CATEGORY_MAPPING = {
+    '0742': [
+        'Animals',
+        'Тварини'
+    ],
+    '4111': [
+        'Transport',
+        'Транспорт'
+    ],
+    '4112': [
+        'Train tickets',
+        'Квитки на поїзд'
+    ],
+    '4814': [
+        'Mobile top-up',
+        'Поповнення мобільного'
+    ],
+    '4829': [
+        'Transfers',
+        'Перекази'
+    ],
+    '5211': [
+        'Home and repair',
+        'Дім та ремонт'
+    ],
+    '5297': [
+        'Online stores',
+        'Інтернет-магазини'
+    ],
+    '5411': [
+        'Supermarkets and groceries',
+        'Супермаркети та продукти'
+    ],
+    '5651': [
+        'Clothes and shoes',
+        'Одяг та взуття'
+    ],
+    '5812': [
+        'Restaurants, cafes, bars',
+        'Ресторани, кафе, бари'
+    ],
+    '5912': [
+        'Pharmacies',
+        'Аптеки'
+    ],
+    '5942': [
+        'Books and stationery',
+        'Книги та канцтовари'
+    ],
+    '6011': [
+        'Cash withdrawal',
+        'Зняття готівки'
+    ],
+    '6012': [
+        'Loans',
+        'Кредити'
+    ],
+    '6531': [
+        'Payments by details',
+        'Платежі за реквізитами'
+    ],
+    '6534': [
+        'Enrollment',
+        'Зарахування'
+    ],
+    '6538': [
+        'Transfer crediting',
+        'Зарахування переказу'
+    ],
+    '6539': [
+        'Transfer from my card',
+        'Зарахування зі своєї картки'
+    ],
+    '6540': [
+        'Transfer to my card',
+        'Переказ на свою картку'
+    ],
+    '6760': [
+        'Savings',
+        'Заощадження'
+    ],
+    '7299': [
+        'Services',
+        'Послуги'
+    ],
+    '8099': [
+        'Medical services',
+        'Медичні послуги'
+    ],
+    '8299': [
+        'Education',
+        'Освіта'
+    ],
+    '8398': [
+        'Foundations and organizations',
+        'Фонди та організації'
+    ],
+    '9999': [
+        'Other',
+        'Інше'
+    ]
+}
+
+
+NAME_TO_MCC = {
+    alias: code
+    for code, aliases in CATEGORY_MAPPING.items()
+    for alias in aliases
+}
+
+# This works regardless of where you run 'manage.py' from
+MCC_FILE = Path(__file__).parent / 'static' / 'mcc-en-groups.json'
+# MCCs are four digits, so every possible code has a slot
+MCC_SLOTS = 10000
+UNCATEGORIZED = 'Other'
+
+_mcc_groups = None
+
+
+def mcc_group_mapping():
+    # {mcc: group description}, parsed on first use rather than at import time
+    global _mcc_groups
+    if _mcc_groups is None:
+        with open(MCC_FILE, 'r', encoding='utf-8') as f:
+            mcc_data = json.load(f)
+        _mcc_groups = {
+            item['mcc']: item['group']['description']
+            for item in mcc_data
+        }
+    return _mcc_groups
+
+
+class Categorizer:
+    # Everything is resolved to integer codes up front: a group index for each of the 10,000
+    # possible MCCs and an MCC for each known bank category name. Categorizing a column is then
+    # array indexing rather than string work per row
+    def __init__(self, mcc_groups, name_to_mcc):
+        self.labels = list(dict.fromkeys([*mcc_groups.values(), UNCATEGORIZED]))
+        label_index = {label: i for i, label in enumerate(self.labels)}
+        self.other = label_index[UNCATEGORIZED]
+
+        self.by_mcc = np.full(MCC_SLOTS, self.other, dtype=np.int16)
+        for mcc, group in mcc_groups.items():
+            if mcc.isdigit() and int(mcc) < MCC_SLOTS:
+                self.by_mcc[int(mcc)] = label_index[group]
+
+        self.bank_names = list(name_to_mcc)
+        self.bank_name_mcc = np.array([int(code) for code in name_to_mcc.values()], dtype=float)
+
+    def group_codes(self, mccs):
+        # mccs is a float array, NaN where there is no usable code
+        codes = np.full(len(mccs), self.other, dtype=np.int16)
+        valid = (mccs >= 0) & (mccs < MCC_SLOTS) & (mccs == np.floor(mccs))
+        codes[valid] = self.by_mcc[mccs[valid].astype(np.int64)]
+        return codes
+
+    def categorize_mccs(self, mccs):
+        # Plain numbers (None for missing) to group labels; no pandas needed
+        codes = self.group_codes(np.asarray(mccs, dtype=float))
+        return [self.labels[code] for code in codes]
+
+    def categorize_column(self, column, bank_names=False):
+        # A column of MCCs (numbers or digit strings) or, with bank_names, of category names,
+        # to a categorical of group labels. Anything unknown becomes UNCATEGORIZED
+        import pandas as pd
+
+        mccs = pd.to_numeric(column, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        if bank_names:
+            names = pd.Categorical(column, categories=self.bank_names).codes
+            known = names >= 0
+            mccs[known] = self.bank_name_mcc[names[known]]
+        return pd.Categorical.from_codes(self.group_codes(mccs), categories=self.labels)
+
+
+@lru_cache(maxsize=None)
+def get_categorizer():
+    # Built once per process; after changing the MCC table, get_categorizer.cache_clear()
+    return Categorizer(mcc_group_mapping(), NAME_TO_MCC)
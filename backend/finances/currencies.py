@@ -0,0 +1,28 @@
+import json
+from pathlib import Path
+
+# ISO 4217 codes, generated from pycountry by `manage.py build_currency_table` so that rate
+# refreshes never have to import it
+ISO4217_FILE = Path(__file__).parent / 'static' / 'iso4217.json'
+HRYVNIA = 980
+
+_by_numeric = None
+
+
+def iso_currencies():
+    # {numeric code: (alpha code, name)}, read on first use
+    global _by_numeric
+    if _by_numeric is None:
+        with open(ISO4217_FILE, 'r', encoding='utf-8') as f:
+            _by_numeric = {item['numeric']: (item['alpha'], item['name']) for item in json.load(f)}
+    return _by_numeric
+
+
+def build_iso_table():
+    import pycountry
+
+    return sorted(
+        ({'numeric': int(currency.numeric), 'alpha': currency.alpha_3, 'name': currency.name}
+         for currency in pycountry.currencies),
+        key=lambda item: item['numeric']
+    )
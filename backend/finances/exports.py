@@ -0,0 +1,63 @@
+import csv
+import io
+import json
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+EXPORT_FIELDS = ['id', 'date', 'name', 'category', 'amount', 'amount_uah', 'balance', 'currency']
+# Rows fetched per database round trip, and rows encoded per chunk handed to the server
+EXPORT_CHUNK_SIZE = 2000
+
+
+def export_rows(queryset):
+    # Plain tuples straight off the cursor: no model instances, no serializer, nothing kept
+    # after a chunk has been written out
+    return queryset.order_by('-date', '-id').values_list(
+        'id', 'date', 'name', 'category', 'amount', 'amount_uah', 'balance', 'balance__currency',
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def _format_value(value):
+    if value is None:
+        return None
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, (int, str)):
+        return value
+    return str(value)
+
+
+def _chunked(rows, buffer, write_row):
+    # Header (if any) is already in the buffer and goes out with the first chunk
+    for count, row in enumerate(rows, 1):
+        write_row([_format_value(value) for value in row])
+        if count % EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    yield from _chunked(rows, buffer, writer.writerow)
+
+
+def stream_ndjson(rows):
+    buffer = io.StringIO()
+
+    def write_row(values):
+        buffer.write(json.dumps(dict(zip(EXPORT_FIELDS, values)), ensure_ascii=False) + '\n')
+
+    yield from _chunked(rows, buffer, write_row)
+
+
+def stream_export(queryset, file_format):
+    rows = export_rows(queryset)
+    if file_format == 'csv':
+        return stream_csv(rows)
+    return stream_ndjson(rows)
@@ -0,0 +1,95 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) seconds per upstream host; a hung upstream must not hold a worker forever
+TIMEOUTS = {
+    'api.monobank.ua': (3.05, 15),
+    'api.coingecko.com': (3.05, 20),
+}
+DEFAULT_TIMEOUT = (3.05, 10)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Monobank answers 429 with Retry-After of up to a minute; past this many seconds the request fails
+# rather than keeping the worker asleep
+MAX_RETRY_AFTER = 5.0
+
+
+class CappedRetry(Retry):
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, MAX_RETRY_AFTER)
+
+
+class HttpClient:
+    # Every outbound call goes through one of these: a pooled keep-alive session, per-host
+    # timeouts, retries with backoff on connection errors and 429/5xx, and per-host latency counters
+    def __init__(self, retries=3, backoff_factor=0.5, pool_size=10):
+        # A read timeout is not retried (read=0): the host's timeout has to bound the whole call
+        retry = CappedRetry(total=retries, read=0, backoff_factor=backoff_factor, status_forcelist=RETRY_STATUSES,
+                            allowed_methods=frozenset({'GET'}), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=len(TIMEOUTS) + 1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def get(self, url, **kwargs):
+        host = urlsplit(url).hostname
+        kwargs.setdefault('timeout', TIMEOUTS.get(host, DEFAULT_TIMEOUT))
+        started = time.perf_counter()
+        try:
+            response = self.session.get(url, **kwargs)
+        except requests.RequestException:
+            self._record(host, time.perf_counter() - started, failed=True)
+            raise
+        self._record(host, time.perf_counter() - started, failed=response.status_code >= 400)
+        return response
+
+    def _record(self, host, seconds, failed):
+        with self._lock:
+            stats = self._stats.setdefault(host, {'requests': 0, 'failures': 0, 'total_seconds': 0.0,
+                                                  'max_seconds': 0.0})
+            stats['requests'] += 1
+            stats['failures'] += failed
+            stats['total_seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+
+    def stats(self):
+        # {host: {requests, failures, total_seconds, max_seconds, mean_seconds}}, retries included
+        with self._lock:
+            return {
+                host: {**stats, 'mean_seconds': stats['total_seconds'] / stats['requests']}
+                for host, stats in self._stats.items()
+            }
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
+
+
+def set_client(client):
+    # Swaps the shared client, e.g. for one with other retry settings; returns the previous one
+    global _client
+    with _client_lock:
+        previous, _client = _client, client
+        return previous
+
+
+def get(url, **kwargs):
+    return get_client().get(url, **kwargs)
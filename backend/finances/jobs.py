@@ -0,0 +1,132 @@
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from finances.models import ImportJob
+
+logger = logging.getLogger(__name__)
+
+# Progress moves after every chunk; rather than a write to the job row each time, live counters go
+# through the (shared) cache
+PROGRESS_CACHE_KEY = 'finances:import:{}:progress'
+PROGRESS_TIMEOUT = 24 * 3600
+
+_workers = []
+_workers_lock = threading.Lock()
+_wake = threading.Event()
+
+
+def start_workers(**kwargs):
+    # Starts this process's IMPORT_WORKER_THREADS pollers once; connected to request_started, so
+    # every web process works the queue from its first request on, jobs that were waiting before
+    # it started included
+    with _workers_lock:
+        if _workers or settings.IMPORT_WORKER_THREADS <= 0:
+            return
+        for number in range(settings.IMPORT_WORKER_THREADS):
+            worker = threading.Thread(target=_work, name=f'import-{number}', daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+
+def enqueue_import(job):
+    # The pollers are woken once the job row is committed, so they are sure to see it. Without
+    # worker threads the job stays pending for `run_import_worker`
+    if settings.IMPORT_WORKER_THREADS > 0:
+        start_workers()
+        transaction.on_commit(_wake.set)
+
+
+def _work():
+    while True:
+        _wake.clear()
+        try:
+            run_pending_jobs()
+        finally:
+            # Pool threads outlive the job; don't leave a connection open in each of them
+            connection.close()
+        _wake.wait(settings.IMPORT_POLL_INTERVAL)
+
+
+def claim_job(job_id=None):
+    # Takes a pending job, or a running one whose worker has not finished it within
+    # IMPORT_JOB_TIMEOUT and is presumed gone. The conditional update is what makes a claim
+    # exclusive between threads and processes
+    stale = timezone.now() - timedelta(seconds=settings.IMPORT_JOB_TIMEOUT)
+    claimable = ImportJob.objects.filter(Q(status=ImportJob.PENDING) | Q(status=ImportJob.RUNNING, started__lt=stale))
+    if job_id is not None:
+        claimable = claimable.filter(pk=job_id)
+    for pk, status, started in claimable.order_by('created', 'pk').values_list('pk', 'status', 'started')[:10]:
+        if ImportJob.objects.filter(pk=pk, status=status, started=started).update(status=ImportJob.RUNNING,
+                                                                                 started=timezone.now()):
+            if status == ImportJob.RUNNING:
+                logger.warning("Import job %s has been running since %s; taking it over", pk, started)
+            return ImportJob.objects.select_related('user', 'balance').get(pk=pk)
+    return None
+
+
+def get_progress(job):
+    return cache.get(PROGRESS_CACHE_KEY.format(job.pk))
+
+
+def run_import_job(job_id=None):
+    # Runs the given pending job, or the oldest one; returns it, or None if there was nothing to claim
+    job = claim_job(job_id)
+    if job is None:
+        return None
+    # Only workers that actually run an import pay for pandas
+    if job.file.name.lower().endswith('.zip'):
+        from finances.archives import import_statement_archive as run_import
+    else:
+        from finances.tasks import import_transaction_file as run_import
+
+    progress_key = PROGRESS_CACHE_KEY.format(job.pk)
+
+    def report(rows_parsed, rows_inserted):
+        cache.set(progress_key, {'rows_parsed': rows_parsed, 'rows_inserted': rows_inserted}, PROGRESS_TIMEOUT)
+
+    try:
+        with job.file.open('rb') as file_obj:
+            result = run_import(file_obj, job.user, job.balance, progress=report)
+    except Exception as e:
+        logger.exception("Import job %s failed", job.pk)
+        job.status = ImportJob.FAILED
+        job.error = str(e) or e.__class__.__name__
+        progress = cache.get(progress_key) or {}
+        job.rows_parsed = progress.get('rows_parsed', 0)
+        # Chunks commit as they go; those before the failure stay, and a retry skips them
+        job.rows_inserted = progress.get('rows_inserted', 0)
+    else:
+        job.status = ImportJob.DONE
+        job.rows_parsed = result['parsed']
+        job.rows_inserted = result['inserted']
+        job.rows_skipped = result['skipped']
+        job.files = result.get('files', [])
+        job.file.delete(save=False)
+
+    job.finished = timezone.now()
+    job.save()
+    cache.delete(progress_key)
+    return job
+
+
+def run_pending_jobs():
+    # Runs jobs until there is none left to claim. An error outside the import itself (claiming
+    # with the database busy, say) is logged and ends the round; the job is picked up on a later poll
+    count = 0
+    while True:
+        try:
+            job = run_import_job()
+        except Exception:
+            logger.exception("Import worker could not run a job")
+            break
+        if job is None:
+            break
+        count += 1
+    return count
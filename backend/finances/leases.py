@@ -0,0 +1,50 @@
+import time
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError
+from django.db.transaction import atomic
+from django.db.models import Q
+from django.utils import timezone
+
+from finances.models import Lease
+
+
+def acquire(name, ttl, min_interval=0):
+    # Takes the lease for ttl seconds unless someone else holds it, or it was last taken less than
+    # min_interval seconds ago. Returns a token for release(), or None. Like claiming an import job,
+    # the conditional update is what makes this exclusive across threads and processes; ttl bounds
+    # how long a holder that died can keep everyone else out
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    free = Q(expires__isnull=True) | Q(expires__lte=now)
+    if min_interval:
+        free &= Q(acquired__isnull=True) | Q(acquired__lte=now - timedelta(seconds=min_interval))
+    if Lease.objects.filter(free, name=name).update(holder=token, acquired=now, expires=now + timedelta(seconds=ttl)):
+        return token
+    try:
+        with atomic():
+            Lease.objects.create(name=name, holder=token, acquired=now, expires=now + timedelta(seconds=ttl))
+    except IntegrityError:
+        # The row exists, so the update above saw it and found it taken
+        return None
+    return token
+
+
+def release(name, token):
+    # Only the holder can release; a lease taken over after it expired is left alone
+    Lease.objects.filter(name=name, holder=token).update(holder="", expires=None)
+
+
+def held(name):
+    return Lease.objects.filter(name=name, expires__gt=timezone.now()).exists()
+
+
+def wait(name, timeout, poll=0.2):
+    # Blocks until nobody holds the lease or timeout seconds have passed; True if it was let go
+    deadline = time.monotonic() + timeout
+    while held(name):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(poll)
+    return True
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from finances.models import Balance
+from finances.snapshots import refresh_balance_snapshots
+
+
+class Command(BaseCommand):
+    help = "Rebuild daily balance snapshots from the existing transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--balance', type=int, action='append', dest='balances',
+                            help="Only rebuild the given balance id (can be repeated)")
+
+    def handle(self, *args, **options):
+        balances = Balance.objects.all()
+        if options['balances']:
+            balances = balances.filter(pk__in=options['balances'])
+
+        count = 0
+        for balance in balances.iterator():
+            refresh_balance_snapshots(balance)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt snapshots for {count} balance(s)"))
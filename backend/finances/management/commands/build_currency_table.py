@@ -0,0 +1,16 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from finances.currencies import ISO4217_FILE, build_iso_table
+
+
+class Command(BaseCommand):
+    help = "Regenerate the ISO 4217 table the exchange-rate refresh reads from pycountry"
+
+    def handle(self, *args, **options):
+        table = build_iso_table()
+        # One currency per line keeps the diffs readable when ISO adds or retires a code
+        lines = ',\n'.join(' ' + json.dumps(item, ensure_ascii=False) for item in table)
+        ISO4217_FILE.write_text(f'[\n{lines}\n]\n', encoding='utf-8')
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(table)} currencies to {ISO4217_FILE}"))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db.transaction import atomic
+
+from finances.models import CategoryRollup, Transaction
+from finances.rollups import category_deltas
+
+
+class Command(BaseCommand):
+    help = "Recompute the category rollups from the raw ledger and report any drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help="Only compare against the ledger, do not rewrite the rollups")
+
+    def handle(self, *args, **options):
+        rows = Transaction.objects.values_list('user_id', 'date', 'category', 'amount', 'amount_uah')
+        expected = category_deltas(rows.iterator(chunk_size=2000))
+        expected = {key: tuple(value) for key, value in expected.items()}
+        stored = {
+            (rollup.user_id, rollup.month, rollup.category): (rollup.inflow, rollup.outflow, rollup.count)
+            for rollup in CategoryRollup.objects.iterator()
+        }
+
+        mismatched = [key for key in expected.keys() | stored.keys() if expected.get(key) != stored.get(key)]
+        for user_id, month, category in sorted(mismatched, key=str):
+            self.stdout.write(f"user={user_id} month={month:%Y-%m} category={category!r}: "
+                              f"stored={stored.get((user_id, month, category))} "
+                              f"ledger={expected.get((user_id, month, category))}")
+
+        if options['check']:
+            if mismatched:
+                self.stdout.write(self.style.ERROR(f"{len(mismatched)} rollup(s) differ from the ledger"))
+            else:
+                self.stdout.write(self.style.SUCCESS("Rollups match the ledger"))
+            return
+
+        with atomic():
+            CategoryRollup.objects.all().delete()
+            CategoryRollup.objects.bulk_create([
+                CategoryRollup(user_id=user_id, month=month, category=category,
+                               inflow=inflow, outflow=outflow, count=count)
+                for (user_id, month, category), (inflow, outflow, count) in expected.items()
+            ], batch_size=500)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(expected)} rollup(s), {len(mismatched)} had drifted"))
@@ -0,0 +1,29 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from finances.rates import refresh_rates_once
+
+
+class Command(BaseCommand):
+    help = "Refresh exchange rates from Monobank and CoinGecko on a fixed cadence until stopped"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Refresh once and exit")
+        parser.add_argument('--interval', type=float, default=None,
+                            help="Seconds between refreshes, defaults to RATES_MAX_AGE")
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or settings.RATES_MAX_AGE
+        while True:
+            started = time.monotonic()
+            # Skipped if a refresh started by a request is running right now
+            refreshed = refresh_rates_once()
+            if refreshed is None:
+                self.stdout.write("Another refresh is running, skipped")
+            else:
+                self.stdout.write(f"Refreshed {' and '.join(refreshed) or 'no'} rates")
+            if options['once']:
+                break
+            time.sleep(max(interval - (time.monotonic() - started), 0))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from finances.jobs import run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = "Run pending statement imports, polling for new ones until stopped"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds between polls of an empty queue")
+
+    def handle(self, *args, **options):
+        while True:
+            count = run_pending_jobs()
+            if count:
+                self.stdout.write(f"Ran {count} import job(s)")
+            if options['once']:
+                break
+            time.sleep(options['interval'])
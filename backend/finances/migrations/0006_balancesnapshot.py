@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0005_rename_id_val_currency_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('amount', models.DecimalField(decimal_places=10, max_digits=30)),
+                ('balance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='finances.balance')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('balance', 'day'), name='unique_balance_snapshot_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:44
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def seed_history(apps, schema_editor):
+    # The latest known rate is the only history we have for existing currencies
+    Currency = apps.get_model('finances', 'Currency')
+    CurrencyRate = apps.get_model('finances', 'CurrencyRate')
+    CurrencyRate.objects.bulk_create([
+        CurrencyRate(currency_id=currency_id, timestamp=updated, rate=rate)
+        for currency_id, updated, rate in Currency.objects.values_list('id', 'updated', 'rate')
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0007_categoryrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrencyRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('rate', models.DecimalField(decimal_places=10, max_digits=30)),
+                ('currency', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='history', to='finances.currency')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['currency', 'timestamp'], name='finances_cu_currenc_179ba8_idx')],
+            },
+        ),
+        migrations.RunPython(seed_history, migrations.RunPython.noop),
+    ]
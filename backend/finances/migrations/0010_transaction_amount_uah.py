@@ -0,0 +1,57 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:52
+
+from bisect import bisect_right
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_amount_uah(apps, schema_editor):
+    # Same as-of rule as finances.rates.RateHistory, inlined because migrations use historical models
+    Balance = apps.get_model('finances', 'Balance')
+    CurrencyRate = apps.get_model('finances', 'CurrencyRate')
+    Transaction = apps.get_model('finances', 'Transaction')
+
+    for balance_id, currency_id, current_rate in Balance.objects.values_list('pk', 'currency', 'currency__rate'):
+        history = list(CurrencyRate.objects.filter(currency=currency_id).order_by('timestamp')
+                       .values_list('timestamp', 'rate'))
+        timestamps = [timestamp for timestamp, _ in history]
+
+        batch = []
+        for transaction in Transaction.objects.filter(balance=balance_id).only('pk', 'date', 'amount'):
+            if history:
+                rate = history[max(bisect_right(timestamps, transaction.date) - 1, 0)][1]
+            else:
+                rate = current_rate
+            transaction.amount_uah = (transaction.amount * rate).quantize(Decimal('1e-10'))
+            batch.append(transaction)
+            if len(batch) >= 1000:
+                Transaction.objects.bulk_update(batch, ['amount_uah'])
+                batch = []
+        Transaction.objects.bulk_update(batch, ['amount_uah'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0009_transaction_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='amount_uah',
+            field=models.DecimalField(blank=True, decimal_places=10, max_digits=30, null=True),
+        ),
+        migrations.RunPython(fill_amount_uah, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['balance', 'amount_uah'], name='transaction_balance_amount_uah'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', 'amount_uah'], name='transaction_user_amount_uah'),
+        ),
+    ]
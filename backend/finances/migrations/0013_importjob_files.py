@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 19:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0012_transaction_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='files',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -20,13 +20,49 @@ class Currency(models.Model):
         super().save(*args, **kwargs)
 
 
+class CurrencyRate(models.Model):
+    currency = models.ForeignKey(Currency, on_delete=models.CASCADE, related_name='history')
+    timestamp = models.DateTimeField(default=timezone.now)
+    rate = models.DecimalField(decimal_places=10, max_digits=30)  # Exchange rate to UAH at that moment
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['currency', 'timestamp']),
+        ]
+
+
 class Transaction(models.Model):
     name = models.CharField(max_length=200, blank=True, default="")
     category = models.CharField(max_length=100)
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Both foreign keys lead the composite indexes below, so they need no index of their own
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     date = models.DateTimeField(default=timezone.now)
     amount = models.DecimalField(decimal_places=10, max_digits=30)
-    balance = models.ForeignKey('Balance', on_delete=models.CASCADE)
+    # UAH value at the rate in force on `date`, stored so that it can be indexed and sorted on
+    amount_uah = models.DecimalField(decimal_places=10, max_digits=30, null=True, blank=True)
+    balance = models.ForeignKey('Balance', on_delete=models.CASCADE, db_index=False)
+    # Set on imported rows only, so that importing the same statement again skips them
+    fingerprint = models.CharField(max_length=64, null=True, blank=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['balance', 'fingerprint'], name='unique_transaction_fingerprint'),
+        ]
+        indexes = [
+            models.Index(fields=['balance', 'date'], name='transaction_balance_date'),
+            models.Index(fields=['balance', 'amount'], name='transaction_balance_amount'),
+            models.Index(fields=['balance', 'amount_uah'], name='transaction_balance_amount_uah'),
+            models.Index(fields=['user', 'date', 'amount'], name='transaction_user_date_amount'),
+            models.Index(fields=['user', 'amount_uah'], name='transaction_user_amount_uah'),
+            models.Index(fields=['user', 'category'], name='transaction_user_category'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Writes that know the rate pass amount_uah in; anything else is converted here
+        if self.amount_uah is None and self.balance_id is not None:
+            from finances.rates import normalize_amounts
+            normalize_amounts([self])
+        super().save(*args, **kwargs)
 
 
 class Balance(models.Model):
@@ -34,3 +70,62 @@ class Balance(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     amount = models.DecimalField(decimal_places=10, max_digits=30)
     currency = ForeignKey(Currency, on_delete=models.CASCADE)
+
+
+class BalanceSnapshot(models.Model):
+    balance = models.ForeignKey(Balance, on_delete=models.CASCADE, related_name='snapshots')
+    day = models.DateField()
+    amount = models.DecimalField(decimal_places=10, max_digits=30)  # Balance amount at the end of the day
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['balance', 'day'], name='unique_balance_snapshot_day'),
+        ]
+
+
+class CategoryRollup(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    month = models.DateField()  # First day of the month
+    category = models.CharField(max_length=100)
+    inflow = models.DecimalField(decimal_places=10, max_digits=30)  # UAH
+    outflow = models.DecimalField(decimal_places=10, max_digits=30)  # UAH, negative like the ledger
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month', 'category'], name='unique_category_rollup'),
+        ]
+
+
+class ImportJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    balance = models.ForeignKey(Balance, on_delete=models.CASCADE)
+    file = models.FileField(upload_to='imports/')  # Removed once the import succeeds
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    rows_parsed = models.IntegerField(default=0)
+    rows_inserted = models.IntegerField(default=0)
+    rows_skipped = models.IntegerField(default=0)  # Already imported before
+    files = models.JSONField(default=list, blank=True)  # Per-statement stats for zip uploads
+    error = models.TextField(blank=True, default="")
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created'], name='importjob_status_created'),
+        ]
+
+
+class Lease(models.Model):
+    # A named lock every process can see: held by `holder` until `expires`, see finances.leases
+    name = models.CharField(max_length=50, primary_key=True)
+    holder = models.CharField(max_length=32, blank=True, default="")
+    acquired = models.DateTimeField(null=True, blank=True)
+    expires = models.DateTimeField(null=True, blank=True)
@@ -0,0 +1,82 @@
+import base64
+import json
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class StandardResultsSetPagination(PageNumberPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 250
+
+
+def encode_cursor(value, pk):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([str(value), pk]).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+
+def decode_cursor(cursor, field):
+    # The value is converted by the sort field it was taken from, so a cursor that doesn't fit the
+    # current ordering is a 404 rather than an error from the filter
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return field.to_python(value), int(pk)
+    except (ValueError, TypeError, ValidationError):
+        raise NotFound("Invalid cursor.")
+
+
+class KeysetPagination(StandardResultsSetPagination):
+    # Page numbers stay the default for backwards compatibility. Passing `cursor` (empty for the
+    # first page) switches to keyset paging over (sort field, id): no COUNT(*) and no OFFSET, so
+    # a deep page costs the same as the first one. The queryset must be ordered by the sort
+    # field followed by id in the same direction
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.use_cursor = self.cursor_query_param in request.query_params
+        if not self.use_cursor:
+            return super().paginate_queryset(queryset, request, view)
+
+        ordering = queryset.query.order_by[0]
+        self.sort_field = ordering.lstrip('-')
+        descending = ordering.startswith('-')
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            value, pk = decode_cursor(cursor, queryset.model._meta.get_field(self.sort_field))
+            if descending:
+                queryset = queryset.filter(**{f'{self.sort_field}__lte': value}).filter(
+                    Q(**{f'{self.sort_field}__lt': value}) | Q(pk__lt=pk))
+            else:
+                queryset = queryset.filter(**{f'{self.sort_field}__gte': value}).filter(
+                    Q(**{f'{self.sort_field}__gt': value}) | Q(pk__gt=pk))
+
+        page_size = self.get_page_size(request)
+        results = list(queryset[:page_size + 1])
+        self.has_next = len(results) > page_size
+        self.results = results[:page_size]
+        return self.results
+
+    def get_next_cursor_link(self):
+        if not self.has_next:
+            return None
+        last = self.results[-1]
+        cursor = encode_cursor(getattr(last, self.sort_field), last.pk)
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_cursor_link(),
+            'results': data,
+        })
@@ -0,0 +1,181 @@
+import csv
+from functools import lru_cache
+
+import pandas as pd
+
+COLUMN_MAPPING = {
+    'date': [
+        'Date', 'date', 'date_and_time',
+        'Дата', 'дата', 'час_транзакції', 'дата_i_час_операції'
+    ],
+    'amount': [
+        'card_currency_amount,_(uah)',
+        'Amount', 'amount', 'amount_in_card_currency',
+        'Сума', 'сума', 'сума_в_валюті_картки', 'всього', 'сума_в_валюті_картки_(uah)'
+    ],
+    'description': [
+        'Description', 'description',
+        'Опис', 'опис', 'призначення', 'деталі_операції', 'опис_операції'
+    ],
+    'category': [
+        'Category', 'category',
+        'Категорія', 'категорія', 'mcc', 'мсс'
+    ],
+    'balance': [
+        'balance', 'баланс',
+        'rest_at_the_end_of_the_period', 'залишок_після_операції', 'залишок_на_кінець_періоду'
+    ]
+}
+
+# Detection only ever reads this much of an upload, whatever its size
+SNIFF_BYTES = 4096
+XLSX_MAGIC = b'PK\x03\x04'
+
+
+def normalize_column(column):
+    return str(column).strip().lower().replace(' ', '_')
+
+
+@lru_cache(maxsize=256)
+def header_mapping(columns):
+    # columns is the header as a tuple; returns (normalized columns, {normalized: canonical name}).
+    # Cached, so each distinct header layout walks COLUMN_MAPPING once per process
+    columns = tuple(normalize_column(column) for column in columns)
+    mapping = {}
+    for target_col, aliases in COLUMN_MAPPING.items():
+        for alias in aliases:
+            if alias in columns:
+                mapping[alias] = target_col
+                break
+    return columns, mapping
+
+
+def normalize_headers(df):
+    columns, mapping = header_mapping(tuple(df.columns))
+    df.columns = columns
+    df.rename(columns=mapping, inplace=True)
+    return df
+
+
+def header_names(columns):
+    # Everything a signature can refer to: the normalized columns and the canonical names they map to
+    columns, mapping = header_mapping(tuple(columns))
+    return set(columns) | set(mapping.values())
+
+
+PARSERS = []
+
+
+def register(parser_class):
+    # Class decorator: new banks plug in by subclassing StatementParser and registering here
+    PARSERS.append(parser_class())
+    return parser_class
+
+
+class StatementParser:
+    name = None
+    extensions = ()
+    # Header names (normalized or canonical) a file needs for this parser to take it
+    signature = frozenset()
+    # True if the category column holds bank category names rather than MCCs
+    category_names = False
+    # Fallbacks are only tried once no bank-specific parser claimed the file
+    fallback = False
+
+    def sniff_header(self, head):
+        # Header row read from the first SNIFF_BYTES of the upload, or None if it can't be told from there
+        return None
+
+    def matches(self, filename, head):
+        if not filename.lower().endswith(self.extensions):
+            return False
+        header = self.sniff_header(head)
+        return header is None or self.signature <= header_names(header)
+
+    def check_header(self, columns):
+        missing = self.signature - header_names(columns)
+        if missing:
+            raise ValueError(f"Not a {self.name} statement: missing {', '.join(sorted(missing))}")
+
+    def read_chunks(self, file_obj, chunk_size):
+        raise NotImplementedError
+
+
+class CSVParser(StatementParser):
+    extensions = ('.csv',)
+
+    def sniff_header(self, head):
+        text = head.decode('utf-8-sig', errors='ignore')
+        first_line = text.splitlines()[0] if text else ''
+        return next(csv.reader([first_line]), [])
+
+    def read_chunks(self, file_obj, chunk_size):
+        yield from pd.read_csv(file_obj, chunksize=chunk_size)
+
+
+@register
+class MonobankCSV(CSVParser):
+    name = 'Monobank CSV'
+    signature = frozenset({'date', 'amount', 'balance', 'mcc'})
+
+
+@register
+class PrivatBankXLSX(StatementParser):
+    name = 'PrivatBank XLSX'
+    extensions = ('.xlsx',)
+    signature = frozenset({'date', 'amount', 'balance', 'category'})
+    category_names = True
+
+    def matches(self, filename, head):
+        # A workbook is a zip whose sheet can't be read from its first bytes; the header is
+        # checked against the signature once the first rows are streamed
+        return filename.lower().endswith(self.extensions) and head.startswith(XLSX_MAGIC)
+
+    def read_chunks(self, file_obj, chunk_size):
+        # openpyxl's read-only mode streams rows off the sheet XML instead of building the whole
+        # workbook in memory like pd.read_excel does
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(file_obj, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            # the first line is header info, so skip it
+            next(rows, None)
+            header = next(rows, None)
+            if header is None:
+                return
+            columns = [str(column) if column is not None else f'unnamed_{i}' for i, column in enumerate(header)]
+
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) == chunk_size:
+                    yield pd.DataFrame.from_records(chunk, columns=columns)
+                    chunk = []
+            if chunk:
+                yield pd.DataFrame.from_records(chunk, columns=columns)
+        finally:
+            workbook.close()
+
+
+@register
+class GenericCSV(CSVParser):
+    # Any CSV with at least a date and an amount; categories may be names or MCCs
+    name = 'CSV'
+    signature = frozenset({'date', 'amount'})
+    category_names = True
+    fallback = True
+
+
+def detect_parser(file_obj):
+    # Picks a parser from the file name and the first SNIFF_BYTES only; None if nothing fits
+    position = file_obj.tell()
+    head = file_obj.read(SNIFF_BYTES)
+    file_obj.seek(position)
+    if isinstance(head, str):
+        head = head.encode()
+
+    for parser in sorted(PARSERS, key=lambda parser: parser.fallback):
+        if parser.matches(file_obj.name, head):
+            return parser
+    return None
@@ -0,0 +1,237 @@
+import logging
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime, time as dt_time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Max, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from finances import leases
+from finances.models import Balance, Currency, CurrencyRate
+
+# Rates change at most hourly, so every process keeps the whole table in memory and only
+# reloads it when the refresh tasks publish a new version through the shared cache
+VERSION_CACHE_KEY = 'finances:rates:version'
+VERSION_CHECK_INTERVAL = 1.0  # seconds between looks at the shared version
+UAH_PRECISION = Decimal('1e-10')  # Same scale as the DecimalFields, so stored sums stay exact
+REFRESH_LEASE = 'rates-refresh'
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_refreshing = threading.Lock()
+_rates = None
+_version = None
+_checked_at = 0.0
+
+
+def invalidate():
+    global _rates, _checked_at
+    with _lock:
+        _rates = None
+        _checked_at = 0.0
+
+
+def bump_version():
+    # Called after the rates were written; other processes pick it up on their next check
+    version = time.time_ns()
+    cache.set(VERSION_CACHE_KEY, version, None)
+    invalidate()
+    return version
+
+
+def rate_table():
+    global _rates, _version, _checked_at
+    now = time.monotonic()
+    rates = _rates
+    if rates is not None and now - _checked_at < VERSION_CHECK_INTERVAL:
+        return rates
+
+    version = cache.get(VERSION_CACHE_KEY)
+    with _lock:
+        if _rates is None or version != _version:
+            _rates = dict(Currency.objects.values_list('id', 'rate'))
+            _version = version
+        _checked_at = now
+        return _rates
+
+
+def get_rate(currency):
+    currency_id = getattr(currency, 'pk', currency)
+    rates = rate_table()
+    if currency_id not in rates:
+        # The currency may have been added after the table was loaded
+        invalidate()
+        rates = rate_table()
+    try:
+        return rates[currency_id]
+    except KeyError:
+        raise Currency.DoesNotExist(f"Unknown currency: {currency_id}")
+
+
+def convert(amount, from_currency, to_currency=None):
+    # Every Currency.rate is quoted in UAH, so to_currency=None converts to UAH
+    if not isinstance(amount, Decimal):
+        amount = Decimal(str(amount))
+    rate = get_rate(from_currency)
+    if to_currency is not None:
+        rate = rate / get_rate(to_currency)
+    return amount * rate
+
+
+def moment(value):
+    # Dates mean "at the close of that day"; naive datetimes (pandas imports) are in the current timezone
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, dt_time.max)
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+class RateHistory:
+    # As-of lookups over CurrencyRate. One query loads a sorted (timestamps, rates) series per
+    # currency, every lookup after that is a bisect, so converting thousands of transactions
+    # costs one query instead of one per row
+    def __init__(self, currencies, start=None, end=None):
+        rows = CurrencyRate.objects.filter(currency__in={getattr(c, 'pk', c) for c in currencies})
+        if end is not None:
+            rows = rows.filter(timestamp__lte=moment(end))
+        if start is not None:
+            # Keep the last rate before the window, it is the one in force at its start
+            latest_before = CurrencyRate.objects.filter(
+                currency=OuterRef('currency'), timestamp__lt=moment(start)).order_by('-timestamp')
+            rows = rows.filter(Q(timestamp__gte=moment(start)) | Q(pk=Subquery(latest_before.values('pk')[:1])))
+
+        self.series = {}
+        for currency_id, timestamp, rate in rows.order_by('currency', 'timestamp').values_list(
+                'currency', 'timestamp', 'rate'):
+            timestamps, rates = self.series.setdefault(currency_id, ([], []))
+            timestamps.append(timestamp)
+            rates.append(rate)
+
+    def rate_at(self, currency, when):
+        currency_id = getattr(currency, 'pk', currency)
+        series = self.series.get(currency_id)
+        if not series:
+            return get_rate(currency_id)
+        timestamps, rates = series
+        index = bisect_right(timestamps, moment(when)) - 1
+        # Before the first recorded rate the earliest one is the best estimate
+        return rates[max(index, 0)]
+
+    def convert(self, amount, currency, when):
+        if not isinstance(amount, Decimal):
+            amount = Decimal(str(amount))
+        return amount * self.rate_at(currency, when)
+
+    def convert_many(self, rows):
+        # rows are (amount, currency, when); returns the UAH amounts in the same order
+        return [self.convert(amount, currency, when) for amount, currency, when in rows]
+
+
+def convert_at(amount, currency, when):
+    return RateHistory([currency], start=when, end=when).convert(amount, currency, when).quantize(UAH_PRECISION)
+
+
+def normalize_amounts(transactions):
+    # Sets amount_uah on a batch of unsaved transactions with two queries, whatever the batch size
+    transactions = list(transactions)
+    if not transactions:
+        return transactions
+    currencies = dict(Balance.objects.filter(pk__in={t.balance_id for t in transactions})
+                      .values_list('pk', 'currency'))
+    dates = [t.date for t in transactions]
+    history = RateHistory(set(currencies.values()), start=min(dates), end=max(dates))
+    for t in transactions:
+        t.amount_uah = history.convert(t.amount, currencies[t.balance_id], t.date).quantize(UAH_PRECISION)
+    return transactions
+
+
+def with_recorded_rate(currencies):
+    # Annotates a Currency queryset with `recorded`, the rate of its latest history row
+    latest = CurrencyRate.objects.filter(currency=OuterRef('pk')).order_by('-timestamp')
+    return currencies.annotate(recorded=Subquery(latest.values('rate')[:1]))
+
+
+def record_history(rates, timestamp=None, recorded=None):
+    # rates is {currency_id: rate}. A rate is in force until the next row for its currency, so only
+    # the ones that differ from their currency's latest row are appended, in one insert. recorded
+    # is {currency_id: latest rate} when the caller already read it (see with_recorded_rate)
+    timestamp = timestamp or timezone.now()
+    if recorded is None:
+        recorded = dict(with_recorded_rate(Currency.objects.filter(pk__in=list(rates))).values_list('pk', 'recorded'))
+    CurrencyRate.objects.bulk_create([
+        CurrencyRate(currency_id=currency_id, timestamp=timestamp, rate=rate)
+        for currency_id, rate in rates.items()
+        if recorded.get(currency_id) is None
+        or recorded[currency_id] != Decimal(str(rate)).quantize(UAH_PRECISION)
+    ], batch_size=500)
+
+
+def rates_updated_at():
+    # Every refresh rewrites the UAH row, so its timestamp is the age of the table
+    return Currency.objects.filter(alpha_code='UAH').aggregate(updated=Max('updated'))['updated']
+
+
+def rates_stale(updated_at):
+    return updated_at is None or timezone.now() - updated_at > timedelta(seconds=settings.RATES_MAX_AGE)
+
+
+def refresh_rates():
+    # Both sources, each on its own: one failing (no CoinGecko key, say) doesn't hold up the other.
+    # Returns the sources that were refreshed
+    from finances import tasks
+
+    refreshed = []
+    for source, fetch in (('fiat', tasks.fetch_exchange_rates), ('crypto', tasks.fetch_crypto_rates)):
+        try:
+            fetch()
+        except Exception:
+            logger.exception("Refreshing %s rates failed", source)
+        else:
+            refreshed.append(source)
+    return refreshed
+
+
+def refresh_rates_once(min_interval=0):
+    # Single flight across every process: runs refresh_rates() only if no refresh is running and
+    # none started in the last min_interval seconds. Returns the sources refreshed, or None if it
+    # didn't run
+    token = leases.acquire(REFRESH_LEASE, settings.RATES_REFRESH_TIMEOUT, min_interval)
+    if token is None:
+        return None
+    try:
+        return refresh_rates()
+    finally:
+        leases.release(REFRESH_LEASE, token)
+
+
+def await_refresh(timeout):
+    # For a caller that lost the race to refresh: True if a refresh was running and finished within
+    # timeout seconds, False if it is still running, None if none was running
+    if not leases.held(REFRESH_LEASE):
+        return None
+    return leases.wait(REFRESH_LEASE, timeout)
+
+
+def refresh_in_background():
+    # Readers never wait for a refresh: a stale read starts one in a thread, unless one is already
+    # running in this process; the lease keeps other processes from starting their own. Returns
+    # True if it started a thread
+    if not settings.RATES_BACKGROUND_REFRESH or not _refreshing.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            refresh_rates_once(settings.RATES_MIN_REFRESH_INTERVAL)
+        finally:
+            connection.close()
+            _refreshing.release()
+
+    threading.Thread(target=run, name='rates-refresh', daemon=True).start()
+    return True
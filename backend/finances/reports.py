@@ -0,0 +1,80 @@
+from decimal import Decimal
+
+from django.db.models import Q, Sum
+from django.db.models.functions import Trunc, TruncDate
+
+from finances.models import CategoryRollup, Transaction
+from finances.rates import RateHistory
+
+CASHFLOW_BUCKETS = ['day', 'week', 'month']
+
+
+def cashflow_queryset(user, start=None, end=None):
+    queryset = Transaction.objects.filter(user=user)
+    if start is not None:
+        queryset = queryset.filter(date__gt=start)
+    if end is not None:
+        queryset = queryset.filter(date__lte=end)
+    return queryset
+
+
+def _flow(inflow, outflow):
+    return {'inflow': inflow, 'outflow': outflow, 'net': inflow + outflow}
+
+
+def cashflow(user, start=None, end=None, bucket=None):
+    # Outflow keeps the ledger sign (negative), so net is simply inflow + outflow.
+    # The database sums per day and currency; each of those subtotals is converted at the
+    # rate in force on its day, so the cost follows days x currencies rather than rows
+    aggregates = {
+        'inflow': Sum('amount', filter=Q(amount__gt=0)),
+        'outflow': Sum('amount', filter=Q(amount__lt=0)),
+    }
+    queryset = cashflow_queryset(user, start, end).annotate(day=TruncDate('date'))
+    if bucket is not None and bucket not in CASHFLOW_BUCKETS:
+        raise ValueError(f"Unsupported bucket: {bucket}")
+
+    fields = ['day', 'balance__currency']
+    if bucket is not None:
+        queryset = queryset.annotate(period=Trunc('date', bucket))
+        fields.insert(0, 'period')
+    rows = list(queryset.values(*fields).annotate(**aggregates).order_by(*fields))
+
+    history = None
+    if rows:
+        history = RateHistory({row['balance__currency'] for row in rows},
+                              start=min(row['day'] for row in rows), end=max(row['day'] for row in rows))
+
+    periods = {}
+    for row in rows:
+        totals = periods.setdefault(row.get('period'), [Decimal(0), Decimal(0)])
+        rate = history.rate_at(row['balance__currency'], row['day'])
+        totals[0] += (row['inflow'] or 0) * rate
+        totals[1] += (row['outflow'] or 0) * rate
+
+    inflow = sum((totals[0] for totals in periods.values()), Decimal(0))
+    outflow = sum((totals[1] for totals in periods.values()), Decimal(0))
+    if bucket is None:
+        return _flow(inflow, outflow)
+
+    buckets = [{'period': period, **_flow(*totals)} for period, totals in periods.items()]
+    return {**_flow(inflow, outflow), 'buckets': buckets}
+
+
+def category_breakdown(user, start, end, by_month=False):
+    # Served from the monthly rollups, so the window is widened to whole months
+    rollups = CategoryRollup.objects.filter(user=user, month__gte=start.replace(day=1), month__lte=end)
+    fields = ['month', 'category'] if by_month else ['category']
+    rows = rollups.values(*fields).annotate(
+        total_inflow=Sum('inflow'),
+        total_outflow=Sum('outflow'),
+        total_count=Sum('count'),
+    ).order_by(*fields[:-1], 'total_outflow', 'category')
+
+    return [{
+        **{field: row[field] for field in fields},
+        'inflow': row['total_inflow'],
+        'outflow': row['total_outflow'],
+        'net': row['total_inflow'] + row['total_outflow'],
+        'count': row['total_count'],
+    } for row in rows]
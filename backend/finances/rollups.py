@@ -0,0 +1,67 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.transaction import atomic
+from django.utils import timezone
+
+from finances.models import CategoryRollup
+
+# What update_category_rollups reads from each transaction
+ROLLUP_FIELDS = ('user', 'date', 'category', 'amount', 'amount_uah')
+
+
+def month_of(date):
+    if timezone.is_aware(date):
+        date = timezone.localtime(date)
+    return date.date().replace(day=1)
+
+
+def category_deltas(rows, sign=1):
+    # rows are (user_id, date, category, amount, amount_uah); returns
+    # {(user_id, month, category): [inflow, outflow, count]}
+    deltas = defaultdict(lambda: [Decimal(0), Decimal(0), 0])
+    for user_id, date, category, amount, amount_uah in rows:
+        delta = deltas[(user_id, month_of(date), category)]
+        if amount > 0:
+            delta[0] += amount_uah * sign
+        elif amount < 0:
+            delta[1] += amount_uah * sign
+        delta[2] += sign
+    return deltas
+
+
+def update_category_rollups(transactions, sign=1):
+    # Call inside the same atomic block as the write, after amount_uah was set;
+    # sign=-1 takes transactions back out
+    deltas = category_deltas([(t.user_id, t.date, t.category, t.amount, t.amount_uah) for t in transactions], sign)
+    if not deltas:
+        return
+
+    with atomic():
+        existing = {
+            (rollup.user_id, rollup.month, rollup.category): rollup
+            for rollup in CategoryRollup.objects.select_for_update().filter(
+                user_id__in={key[0] for key in deltas},
+                month__in={key[1] for key in deltas},
+                category__in={key[2] for key in deltas},
+            )
+        }
+
+        changed, emptied = [], []
+        for key, (inflow, outflow, count) in deltas.items():
+            rollup = existing.get(key) or CategoryRollup(user_id=key[0], month=key[1], category=key[2],
+                                                         inflow=0, outflow=0, count=0)
+            rollup.inflow += inflow
+            rollup.outflow += outflow
+            rollup.count += count
+            if rollup.count <= 0:
+                if rollup.pk:
+                    emptied.append(rollup.pk)
+            else:
+                changed.append(rollup)
+
+        CategoryRollup.objects.bulk_create(changed, batch_size=500, update_conflicts=True,
+                                           unique_fields=['user', 'month', 'category'],
+                                           update_fields=['inflow', 'outflow', 'count'])
+        if emptied:
+            CategoryRollup.objects.filter(pk__in=emptied).delete()
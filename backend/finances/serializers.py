@@ -1,13 +1,14 @@
 from rest_framework import serializers
 
-from finances.models import Transaction, Balance, Currency
+from finances.jobs import get_progress
+from finances.models import Transaction, Balance, Currency, ImportJob
 
 
 class TransactionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Transaction
         fields = '__all__'
-        read_only_fields = ['user', 'balance']
+        read_only_fields = ['user', 'balance', 'amount_uah']
 
 
 class BalanceSerializer(serializers.ModelSerializer):
@@ -31,3 +32,16 @@ class CurrencySerializer(serializers.ModelSerializer):
     class Meta:
         model = Currency
         fields = ['id', 'alpha_code', 'name', 'rate']
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ImportJob
+        fields = ['id', 'balance', 'status', 'rows_parsed', 'rows_inserted', 'rows_skipped', 'files', 'error',
+                  'created', 'started', 'finished']
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if instance.status == ImportJob.RUNNING:
+            data.update(get_progress(instance) or {})
+        return data
@@ -0,0 +1,90 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import TruncDate
+from django.db.transaction import atomic
+from django.utils import timezone
+
+from finances.models import Balance, BalanceSnapshot, Transaction
+from finances.rates import RateHistory
+
+
+def start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def refresh_balance_snapshots(balance, since=None):
+    # A snapshot is the balance amount at the end of its day, i.e. the current amount minus
+    # everything booked after that day. Rows exist for every day with activity (plus today),
+    # so only days from `since` onwards are recomputed; older rows are shifted as a block
+    # when the write changed the balance by more than the transactions it booked (imports)
+    amount = Balance.objects.filter(pk=balance.pk).values_list('amount', flat=True).get()
+    today = timezone.localdate()
+
+    transactions = Transaction.objects.filter(balance=balance)
+    if since is not None:
+        transactions = transactions.filter(date__gte=start_of_day(since))
+    daily = dict(
+        transactions.annotate(day=TruncDate('date')).values('day').annotate(total=Sum('amount'))
+        .order_by().values_list('day', 'total')
+    )
+    if since is None or since <= today:
+        daily.setdefault(today, Decimal(0))
+
+    snapshots = []
+    running = amount
+    for day in sorted(daily, reverse=True):
+        snapshots.append(BalanceSnapshot(balance=balance, day=day, amount=running))
+        running -= daily[day]
+
+    with atomic():
+        existing = BalanceSnapshot.objects.filter(balance=balance)
+        if since is None:
+            existing.delete()
+        else:
+            existing.filter(day__gte=since).delete()
+            older = list(existing.filter(day__lt=since).order_by('-day'))
+            # `running` is now the amount at the end of the day before `since`, which is what
+            # the latest older row should read
+            shift = running - older[0].amount if older else 0
+            if shift:
+                for snapshot in older:
+                    snapshot.amount += shift
+                BalanceSnapshot.objects.bulk_update(older, ['amount'], batch_size=500)
+        BalanceSnapshot.objects.bulk_create(snapshots, batch_size=500)
+
+
+def net_worth_history(user, start, end, balance_id=None):
+    snapshots = BalanceSnapshot.objects.filter(balance__user=user)
+    if balance_id is not None:
+        snapshots = snapshots.filter(balance_id=balance_id)
+    fields = ('balance', 'balance__currency', 'day', 'amount')
+
+    # The last row before the window carries each balance into the first day shown
+    latest_before = BalanceSnapshot.objects.filter(balance=OuterRef('balance'), day__lt=start).order_by('-day')
+    baseline = snapshots.filter(day=Subquery(latest_before.values('day')[:1]))
+    window = snapshots.filter(day__gte=start, day__lte=end)
+
+    current = {}
+    currencies = {}
+    for row in baseline.values(*fields):
+        current[row['balance']] = row['amount']
+        currencies[row['balance']] = row['balance__currency']
+    changes = defaultdict(dict)
+    for row in window.values(*fields):
+        changes[row['day']][row['balance']] = row['amount']
+        currencies[row['balance']] = row['balance__currency']
+
+    # Forward-filled days are valued at their own closing rate too, not the one of the last row
+    history = RateHistory(set(currencies.values()), start=start, end=end)
+    points = []
+    day = start
+    while day <= end:
+        current.update(changes.get(day, {}))
+        amount_uah = sum((history.convert(amount, currencies[balance], day) for balance, amount in current.items()),
+                         Decimal(0))
+        points.append({'day': day, 'amount_uah': amount_uah})
+        day += timedelta(days=1)
+    return points
@@ -1,54 +1,93 @@
-import pycountry
-import requests
+import hashlib
+import logging
 import os
-import json
+from contextlib import closing
+from itertools import islice
+import numpy as np
 import pandas as pd
 import dotenv
-from pathlib import Path
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Max
+from django.db.transaction import atomic
+from django.utils import timezone
 
 dotenv.load_dotenv()
 
+from finances import http_client
+from finances.categories import get_categorizer
+from finances.currencies import HRYVNIA, iso_currencies
 from finances.models import Currency, Transaction, Balance
+from finances.parsers import detect_parser, normalize_headers
+from finances.rates import bump_version, normalize_amounts, record_history, with_recorded_rate
+from finances.rollups import update_category_rollups
+from finances.snapshots import refresh_balance_snapshots
+
+logger = logging.getLogger(__name__)
+
+
+def hryvnia(existing):
+    # The UAH row, at rate 1: the stored one if there is one, whatever id it was created under
+    alpha_code, name = iso_currencies()[HRYVNIA]
+    uah = next((c for c in existing if c.alpha_code == alpha_code), None) or Currency(
+        id=alpha_code, alpha_code=alpha_code, num_code=HRYVNIA, name=name)
+    uah.rate = 1
+    return uah
 
 
 def fetch_exchange_rates():
-    url = "https://api.monobank.ua/bank/currency"
+    # Returns {'updated': [currency ids], 'skipped': [{'code': ..., 'reason': ...}]}
+    url = f"{settings.MONOBANK_API_URL}/bank/currency"
     headers = {
         "Content-Type": "application/json",
     }
 
-    currency_object = pycountry.currencies.get(numeric="980")
-    Currency.objects.update_or_create(
-        num_code=currency_object.numeric,
-        id=currency_object.alpha_3,
-        name=currency_object.name,
-        rate=1,
-    )
+    response = http_client.get(url, headers=headers)
+    response.raise_for_status()
 
-    response = requests.get(url, headers=headers)
+    table = iso_currencies()
+    currencies = {}
+    skipped = []
     for rate in response.json():
-        if rate["currencyCodeB"] != 980:
+        if rate["currencyCodeB"] != HRYVNIA:
             continue
         code = rate["currencyCodeA"]
-        currency_object = pycountry.currencies.get(numeric=f"{code:03}")
-
-        if "rateCross" not in rate:
-            rate["rateCross"] = rate["rateBuy"]
-        try:
-            Currency.objects.update_or_create(
-                num_code=code,
-                id=currency_object.alpha_3,
-                name=currency_object.name,
-                defaults={
-                    "rate": rate["rateCross"],
-                }
-            )
-        except Exception as e:
-            print(e)
+        if code not in table:
+            skipped.append({"code": code, "reason": "unknown ISO 4217 code"})
+            continue
+        value = rate.get("rateCross", rate.get("rateBuy"))
+        if value is None:
+            skipped.append({"code": code, "reason": "no rate"})
+            continue
+        alpha_code, name = table[code]
+        currencies[alpha_code] = Currency(num_code=code, alpha_code=alpha_code, name=name, rate=value)
+
+    # The whole refresh is one commit, fetched over the network before the write lock is taken
+    with atomic():
+        existing = list(with_recorded_rate(Currency.objects.exclude(num_code=None))
+                        .only('id', 'alpha_code', 'num_code', 'name'))
+        # Rows keep the id they were created under
+        ids = {c.alpha_code: c.pk for c in existing}
+        for alpha_code, currency in currencies.items():
+            currency.id = ids.get(alpha_code, alpha_code)
+        currencies = [hryvnia(existing)] + list(currencies.values())
+        Currency.objects.bulk_create(currencies, update_conflicts=True, unique_fields=['id'],
+                                     update_fields=['num_code', 'alpha_code', 'name', 'rate', 'updated'])
+        record_history({currency.pk: currency.rate for currency in currencies},
+                       recorded={currency.pk: currency.recorded for currency in existing})
+    bump_version()
+
+    if skipped:
+        logger.warning("Skipped %d Monobank rate(s): %s", len(skipped),
+                       ", ".join(f"{item['code']} ({item['reason']})" for item in skipped),
+                       extra={"skipped": skipped})
+    return {"updated": [currency.pk for currency in currencies], "skipped": skipped}
 
 
 def fetch_crypto_rates():
-    url = "https://api.coingecko.com/api/v3/coins/markets"
+    url = f"{settings.COINGECKO_API_URL}/coins/markets"
     headers = {
         "Content-Type": "application/json",
     }
@@ -65,248 +104,301 @@ def fetch_crypto_rates():
         "x_cg_demo_api_key": api_key  # get your own API key from coingecko
     }
 
-    # this actually fetches crypto to UAH rates directly, so no painful conversions needed
-    currency_object = pycountry.currencies.get(numeric="980")
-
-    Currency.objects.update_or_create(
-        num_code=currency_object.numeric,
-        alpha_code=currency_object.alpha_3,
-        name=currency_object.name,
-        rate=1,
-    )
-    response = requests.get(url, headers=headers, params=params)
+    response = http_client.get(url, headers=headers, params=params)
     response.raise_for_status()
-    for coin in response.json():
-        id_val = coin["id"]
-        alpha_code = coin["symbol"].upper()
-        name = coin["name"]
-        rate = coin["current_price"]
 
-        try:
-            existing = Currency.objects.get(id=alpha_code)
-            if existing.name == name:
-                id_val = alpha_code
-        except Currency.DoesNotExist:
-            id_val = alpha_code
-
-        Currency.objects.update_or_create(
-            num_code=None,
-            alpha_code=alpha_code,
-            name=name,
-            rate=rate,
-            id=id_val
-        )
-
-
-COLUMN_MAPPING = {
-    'date': [
-        'Date', 'date', 'date_and_time',
-        'Дата', 'дата', 'час_транзакції', 'дата_i_час_операції'
-    ],
-    'amount': [
-        'card_currency_amount,_(uah)',
-        'Amount', 'amount', 'amount_in_card_currency',
-        'Сума', 'сума', 'сума_в_валюті_картки', 'всього', 'сума_в_валюті_картки_(uah)'
-    ],
-    'description': [
-        'Description', 'description',
-        'Опис', 'опис', 'призначення', 'деталі_операції', 'опис_операції'
-    ],
-    'category': [
-        'Category', 'category',
-        'Категорія', 'категорія', 'mcc', 'мсс'
-    ],
-    'balance': [
-        'balance', 'баланс',
-        'rest_at_the_end_of_the_period', 'залишок_після_операції', 'залишок_на_кінець_періоду'
-    ]
-}
-
-CATEGORY_MAPPING = {
-    '0742': [
-        'Animals',
-        'Тварини'
-    ],
-    '4111': [
-        'Transport',
-        'Транспорт'
-    ],
-    '4112': [
-        'Train tickets',
-        'Квитки на поїзд'
-    ],
-    '4814': [
-        'Mobile top-up',
-        'Поповнення мобільного'
-    ],
-    '4829': [
-        'Transfers',
-        'Перекази'
-    ],
-    '5211': [
-        'Home and repair',
-        'Дім та ремонт'
-    ],
-    '5297': [
-        'Online stores',
-        'Інтернет-магазини'
-    ],
-    '5411': [
-        'Supermarkets and groceries',
-        'Супермаркети та продукти'
-    ],
-    '5651': [
-        'Clothes and shoes',
-        'Одяг та взуття'
-    ],
-    '5812': [
-        'Restaurants, cafes, bars',
-        'Ресторани, кафе, бари'
-    ],
-    '5912': [
-        'Pharmacies',
-        'Аптеки'
-    ],
-    '5942': [
-        'Books and stationery',
-        'Книги та канцтовари'
-    ],
-    '6011': [
-        'Cash withdrawal',
-        'Зняття готівки'
-    ],
-    '6012': [
-        'Loans',
-        'Кредити'
-    ],
-    '6531': [
-        'Payments by details',
-        'Платежі за реквізитами'
-    ],
-    '6534': [
-        'Enrollment',
-        'Зарахування'
-    ],
-    '6538': [
-        'Transfer crediting',
-        'Зарахування переказу'
-    ],
-    '6539': [
-        'Transfer from my card',
-        'Зарахування зі своєї картки'
-    ],
-    '6540': [
-        'Transfer to my card',
-        'Переказ на свою картку'
-    ],
-    '6760': [
-        'Savings',
-        'Заощадження'
-    ],
-    '7299': [
-        'Services',
-        'Послуги'
-    ],
-    '8099': [
-        'Medical services',
-        'Медичні послуги'
-    ],
-    '8299': [
-        'Education',
-        'Освіта'
-    ],
-    '8398': [
-        'Foundations and organizations',
-        'Фонди та організації'
-    ],
-    '9999': [
-        'Other',
-        'Інше'
+    # this actually fetches crypto to UAH rates directly, so no painful conversions needed
+    with atomic():
+        # One read of what is there, the matching done in memory, one upsert for the lot
+        existing = list(with_recorded_rate(Currency.objects.all()).only('id', 'alpha_code', 'num_code', 'name'))
+        currencies = [hryvnia(existing)] + reconcile_coins(response.json(), existing)
+        Currency.objects.bulk_create(currencies, update_conflicts=True, unique_fields=['id'],
+                                     update_fields=['alpha_code', 'name', 'rate', 'updated'])
+
+        record_history({currency.pk: currency.rate for currency in currencies},
+                       recorded={currency.pk: currency.recorded for currency in existing})
+    bump_version()
+
+
+def reconcile_coins(coins, existing):
+    # Coins are keyed by their CoinGecko id, which stays put when a coin is renamed and, unlike
+    # the ticker, is unique (several coins share "SOL" or "USDC"). Coins stored under their ticker
+    # by earlier versions keep that row, so balances held in them carry on. Returns unsaved
+    # Currency objects for the upsert
+    ids = {currency.id: currency for currency in existing}
+    legacy = {(currency.alpha_code, currency.name): currency.id
+              for currency in existing if currency.num_code is None}
+
+    currencies = {}
+    for coin in coins:
+        if coin.get("current_price") is None:
+            continue
+        alpha_code = coin["symbol"].upper()
+        currency_id = coin["id"]
+        if currency_id not in ids:
+            currency_id = legacy.get((alpha_code, coin["name"]), currency_id)
+        elif ids[currency_id].num_code is not None:
+            # A fiat currency already has this id; its rate comes from the bank, not from here
+            continue
+        currencies[currency_id] = Currency(id=currency_id, alpha_code=alpha_code, num_code=None, name=coin["name"],
+                                           rate=coin["current_price"])
+    return list(currencies.values())
+
+
+IMPORT_BATCH_SIZE = 2000
+# Rows parsed and held at once while importing a statement
+IMPORT_CHUNK_SIZE = 20000
+
+
+def row_columns(df):
+    # Column-wise: each column is converted to plain Python values in one pass, instead of boxing
+    # every row into a Series with iterrows(). Returns dates, amounts and descriptions
+    dates = pd.DatetimeIndex(localize_dates(df['date'])).to_pydatetime()
+    amounts = df['amount'].tolist()
+    # Use the column only if it was in the file
+    names = df['description'].fillna('').astype(str).tolist() if 'description' in df else [''] * len(df)
+    return dates, amounts, names
+
+
+def build_transactions(df, user, balance, twins=None):
+    dates, amounts, names = row_columns(df)
+    categories = df['category'].tolist() if 'category' in df else ['Uncategorized'] * len(df)
+    if twins is None:
+        twins = TwinCounter(lambda: row_keys(balance, dates, amounts, names))
+    fingerprints = row_fingerprints(balance, dates, amounts, names, twins)
+    return [
+        Transaction(date=date, amount=amount, name=name, category=category, user_id=user.pk, balance_id=balance.pk,
+                    fingerprint=fingerprint)
+        for date, amount, name, category, fingerprint in zip(dates, amounts, names, categories, fingerprints)
     ]
-}
-
 
-def normalize_headers(df):
-    df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_')
-    for target_col, aliases in COLUMN_MAPPING.items():
-
-        for alias in aliases:
-            if alias in df.columns:
-                df.rename(columns={alias: target_col}, inplace=True)
-                break
-    return df
-
-
-NAME_TO_MCC = {
-    alias: code
-    for code, aliases in CATEGORY_MAPPING.items()
-    for alias in aliases
-}
-
-
-def map_category(df):
-    df['category'] = df['category'].replace(NAME_TO_MCC)
-    df['category'] = df['category'].str.split('.').str[0]
 
+class TwinCounter:
+    # Identical rows are legitimate (two equal payments in the same second), so each one's
+    # ordinal among its twins, in file order, goes into the fingerprint as well. Twins share a
+    # timestamp, so while the rows come sorted (either way) only the rows at the current one are
+    # counted and earlier timestamps are forgotten. A row that goes back to a timestamp already left
+    # means the file is unsorted: from then on every row is counted, starting with the ones before,
+    # which replay() reads again as (moment, key) from the start of the file
+    def __init__(self, replay):
+        self.replay = replay
+        self.moment = None
+        self.direction = 0
+        self.sorted = True
+        self.counts = {}
+        self.seen = 0
+
+    def __call__(self, moment, key):
+        if self.sorted and moment != self.moment:
+            step = 0 if self.moment is None else 1 if moment > self.moment else -1
+            if self.direction and step != self.direction:
+                self.count_all()
+            else:
+                self.direction = self.direction or step
+                self.moment, self.counts = moment, {}
+        ordinal = self.add(key)
+        self.seen += 1
+        return ordinal
+
+    def add(self, key):
+        # A short digest per distinct row rather than the row itself
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        ordinal = self.counts.get(digest, 0)
+        self.counts[digest] = ordinal + 1
+        return ordinal
+
+    def count_all(self):
+        self.sorted = False
+        self.counts = {}
+        with closing(self.replay()) as rows:
+            for _, key in islice(rows, self.seen):
+                self.add(key)
+
+
+def row_keys(balance, dates, amounts, names):
+    # (UTC time, balance|time|amount|description) per row: what makes two rows twins
+    for date, amount, name in zip(dates, amounts, names):
+        moment = date.astimezone(dt_timezone.utc)
+        yield moment, f"{balance.pk}|{moment.isoformat()}|{Decimal(str(amount)).normalize():f}|{name}"
+
+
+def row_fingerprints(balance, dates, amounts, names, twins):
+    # sha256 of balance, UTC time, amount, description and twin ordinal
+    return [hashlib.sha256(f"{key}|{twins(moment, key)}".encode()).hexdigest()
+            for moment, key in row_keys(balance, dates, amounts, names)]
+
+
+def localize_dates(dates):
+    # Statements carry wall-clock times; read them in the current time zone like Django would
+    # for a naive value, but for the whole column at once
+    if dates.dt.tz is not None:
+        return dates
+    return dates.dt.tz_localize(timezone.get_current_timezone(), ambiguous=np.ones(len(dates), dtype=bool),
+                                nonexistent='shift_forward')
+
+
+def prepare_chunk(df, parser):
+    df = normalize_headers(df)
 
-current_dir = Path(__file__).parent
+    df['date'] = pd.to_datetime(df['date'], dayfirst=True)
+    df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
+    if 'balance' in df:
+        df['balance'] = pd.to_numeric(df['balance'], errors='coerce')
 
-# 2. Build the path to the JSON file relative to tasks.py
-# This works regardless of where you run 'manage.py' from
-file_path = current_dir / 'static' / 'mcc-en-groups.json'
+    df.dropna(subset=['date', 'amount'], inplace=True)
 
-with open(file_path, 'r', encoding='utf-8') as f:
-    mcc_data = json.load(f)
-MCC_GROUP_MAPPING = {
-    item['mcc']: item['group']['description']
-    for item in mcc_data
-}
+    if 'category' in df:
+        # PrivatBank exports name the category, Monobank gives the MCC
+        df['category'] = get_categorizer().categorize_column(df['category'], bank_names=parser.category_names)
+    return df
 
 
-def normalize_category(df):
-    df['category'] = df['category'].astype(str).str.split('.').str[0]
-    df['category'] = df['category'].apply(lambda x: x.zfill(4) if x.isdigit() else x)
-    df['category'] = df['category'].map(MCC_GROUP_MAPPING).fillna('Other')
+def existing_fingerprints(balance, transactions):
+    # One index range scan per chunk over (balance, date) instead of a lookup per row
+    dates = [t.date for t in transactions]
+    return set(Transaction.objects.filter(balance=balance, date__range=(min(dates), max(dates)),
+                                          fingerprint__isnull=False).values_list('fingerprint', flat=True))
 
 
-def import_transaction_file(file_obj, user, balance):
-    is_privatbank = False
-    if file_obj.name.endswith('.csv'):  # assume monobank csv
-        df = pd.read_csv(file_obj)
-    elif file_obj.name.endswith(('.xlsx')):
-        # the first line is header info, so skip it
-        df = pd.read_excel(file_obj, header=1)
-        is_privatbank = True
-    else:
+def read_transactions(file_obj, user, balance, chunk_size=IMPORT_CHUNK_SIZE):
+    # Parses a statement chunk by chunk without touching the database. Yields (rows parsed,
+    # transactions, running balance after the chunk's first row or None if the file has none)
+    parser = detect_parser(file_obj)
+    if parser is None:
         raise ValueError("Unsupported file type")
-    df = normalize_headers(df)
 
-    df['date'] = pd.to_datetime(df['date'], dayfirst=True)
-    df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
-    df['balance'] = pd.to_numeric(df['balance'], errors='coerce')
+    start = file_obj.tell()
 
-    df.dropna(subset=['date', 'amount'], inplace=True)
-
-    if is_privatbank: map_category(df)
-    normalize_category(df)
-    transactions = []
-    for _, row in df.iterrows():
-        transactions.append(
-            Transaction(
-                date=row['date'],
-                amount=row['amount'],
-                # Use .get() in case description/category weren't in the file
-                name=row.get('description', ''),
-                category=row.get('category', 'Uncategorized'),
-                user=user,
-                balance=balance
-            )
-        )
-
-    Transaction.objects.bulk_create(transactions)
-
-    latest_balance = df.iloc[0]['balance']
-    balance.amount = latest_balance
-    balance.save()
-
-    return {"status": "success", "count": len(transactions)}
+    def replay():
+        # The keys of the file's rows from the top, through a reader of their own; the one in
+        # progress finds the file where it left it
+        position = file_obj.tell()
+        file_obj.seek(start)
+        try:
+            for df in parser.read_chunks(file_obj, chunk_size):
+                yield from row_keys(balance, *row_columns(prepare_chunk(df, parser)))
+        finally:
+            file_obj.seek(position)
+
+    twins = TwinCounter(replay)
+    checked = False
+    for df in parser.read_chunks(file_obj, chunk_size):
+        if not checked:
+            parser.check_header(df.columns)
+            checked = True
+        parsed = len(df)
+        df = prepare_chunk(df, parser)
+        if df.empty:
+            yield parsed, [], None
+            continue
+        yield parsed, build_transactions(df, user, balance, twins), df.iloc[0]['balance'] if 'balance' in df else None
+
+
+def insert_new(balance, transactions):
+    # Inserts the transactions not stored yet and returns the ones that actually went in. Call it
+    # inside a transaction that took lock_balance(), so no other import of the balance runs between
+    # the check and the insert and what is stored afterwards, but was not before, is this call's doing
+    seen = existing_fingerprints(balance, transactions)
+    candidates = {}
+    for t in transactions:
+        if t.fingerprint not in seen:
+            candidates.setdefault(t.fingerprint, t)
+    if not candidates:
+        return []
+    new = list(candidates.values())
+    normalize_amounts(new)
+    # The unique (balance, fingerprint) index has the last word over any writer that did not take
+    # the lock; ignore_conflicts drops those rows without saying which, so the chunk is read back
+    Transaction.objects.bulk_create(new, batch_size=IMPORT_BATCH_SIZE, ignore_conflicts=True)
+    stored = existing_fingerprints(balance, new) - seen
+    new = [t for t in new if t.fingerprint in stored]
+    # bulk_create skips signals and save(), so the rollups are fed explicitly
+    update_category_rollups(new)
+    return new
+
+
+class InsertedRows:
+    # What an import has inserted so far, carried across its chunks without holding on to the rows,
+    # and the newest row the balance had before the import's first chunk
+    def __init__(self):
+        self.count = 0
+        self.earliest = None
+        self.newest_before = None
+        self.started = False
+
+    def add(self, new):
+        if not new:
+            return
+        earliest = min(t.date for t in new)
+        self.earliest = earliest if self.earliest is None else min(self.earliest, earliest)
+        self.count += len(new)
+
+
+def insert_chunk(balance, transactions, inserted, latest_balance, latest_date):
+    # Inserts one chunk of an import and applies it to the balance in a transaction of its own, so
+    # the write lock is held for a chunk at a time and other writers get in between chunks
+    with atomic():
+        lock_balance(balance)
+        if not inserted.started:
+            inserted.newest_before, inserted.started = newest_transaction_date(balance), True
+        new = insert_new(balance, transactions)
+        settle_balance(balance, new, latest_balance, latest_date, inserted.newest_before)
+    inserted.add(new)
+    return new
+
+
+def settle_balance(balance, new, latest_balance, latest_date, newest_before):
+    # Brings the balance amount in line with newly inserted rows, in the transaction that inserted them
+    if not new:
+        return
+    if latest_balance is None:
+        # No running balance in the file: apply the new rows like API writes do
+        balance.amount += sum(Decimal(str(t.amount)) for t in new)
+        balance.save()
+    # An older statement imported late must not wind the balance back
+    elif newest_before is None or latest_date >= newest_before:
+        balance.amount = latest_balance
+        balance.save()
+
+
+def settle_snapshots(balance, inserted):
+    # Once per import: every day from its earliest new row on is recomputed in one pass
+    if inserted.count:
+        refresh_balance_snapshots(balance, since=timezone.localdate(inserted.earliest))
+
+
+def lock_balance(balance):
+    # Serializes imports into one balance: a row lock where the database has them; SQLite already
+    # holds its write lock from the start of the (IMMEDIATE) transaction. The amount is re-read
+    # under the lock, as whoever held it before may have changed it
+    balance.amount = Balance.objects.select_for_update().filter(pk=balance.pk).values_list('amount', flat=True).get()
+
+
+def newest_transaction_date(balance):
+    return Transaction.objects.filter(balance=balance).aggregate(newest=Max('date'))['newest']
+
+
+def import_transaction_file(file_obj, user, balance, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    # Works through the statement chunk by chunk, so memory is bounded by chunk_size rather
+    # than by the size of the file. progress(rows_parsed, rows_inserted) is called after each chunk.
+    # Every chunk commits on its own; rows already imported (same fingerprint) are skipped, so an
+    # import that failed halfway, like an overlapping statement, can simply be run again
+    chunks = read_transactions(file_obj, user, balance, chunk_size)
+
+    latest_balance = latest_date = None
+    inserted = InsertedRows()
+    parsed = skipped = 0
+    for chunk_parsed, transactions, first_balance in chunks:
+        parsed += chunk_parsed
+        if transactions:
+            # Statements are newest first, so the running balance of the very first row is the current one
+            if latest_date is None:
+                latest_date, latest_balance = transactions[0].date, first_balance
+            new = insert_chunk(balance, transactions, inserted, latest_balance, latest_date)
+            skipped += len(transactions) - len(new)
+        if progress: progress(parsed, inserted.count)
+
+    settle_snapshots(balance, inserted)
+
+    count = inserted.count
+    return {"status": "success", "count": count, "parsed": parsed, "inserted": count, "skipped": skipped}
@@ -1,28 +1,52 @@
-from datetime import timedelta
+from datetime import datetime, time, timedelta
+from decimal import Decimal
 
-from django.http.response import Http404
+from django.conf import settings
+from django.db.models import F, Sum, Window
+from django.db.transaction import atomic
+from django.http.response import Http404, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import http_date
 from rest_framework import generics
 from rest_framework.decorators import api_view
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
-from finances.serializers import TransactionSerializer, BalanceSerializer, FileUploadSerializer, CurrencySerializer
-from finances.models import Transaction, Balance, Currency
+from finances.serializers import TransactionSerializer, BalanceSerializer, FileUploadSerializer, CurrencySerializer, \
+    ImportJobSerializer
+from finances.exports import EXPORT_FORMATS, stream_export
+from finances.jobs import enqueue_import
+from finances.models import Transaction, Balance, Currency, ImportJob
+from finances.pagination import KeysetPagination
+from finances.rates import await_refresh, convert, convert_at, rates_stale, rates_updated_at, \
+    refresh_in_background, refresh_rates_once
+from finances.reports import cashflow, category_breakdown, CASHFLOW_BUCKETS
+from finances.rollups import ROLLUP_FIELDS, update_category_rollups
+from finances.snapshots import refresh_balance_snapshots, net_worth_history
 
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.exceptions import ValidationError
 
-from finances.tasks import import_transaction_file, fetch_exchange_rates, fetch_crypto_rates
 from monobank.models import MonobankUser, MonobankBalance
 from monobank.views import fetch_monobank_report
 
 
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 10
-    page_size_query_param = 'page_size'
-    max_page_size = 250
+def sort_transactions(queryset, query_params, allowed_sort_fields=('date', 'amount', 'amount_uah')):
+    sort_by = query_params.get('sort_by')
+    order = query_params.get('order')  # 'asc'/'desc'
+    allowed_order_fields = ['asc', 'desc']
+
+    if not sort_by or sort_by not in allowed_sort_fields: sort_by = 'date'
+    if not order or order not in allowed_order_fields: order = 'desc'
+
+    # id breaks ties, which keeps pages stable and gives the cursor a unique position
+    tiebreak = 'id'
+    if order == 'desc':
+        sort_by = '-' + sort_by
+        tiebreak = '-id'
+
+    return queryset.order_by(sort_by, tiebreak)
 
 
 class TransactionList(generics.ListCreateAPIView):
@@ -30,7 +54,7 @@ class TransactionList(generics.ListCreateAPIView):
     serializer_class = TransactionSerializer
     permission_classes = [
         IsAuthenticated]  # Only allow authorized users so that we can gracefully return 403 if an anonymous user hits the endpoint
-    pagination_class = StandardResultsSetPagination
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         balance_id = self.kwargs["pk"]
@@ -40,23 +64,9 @@ class TransactionList(generics.ListCreateAPIView):
             raise Http404
 
         queryset = Transaction.objects.all().filter(balance=balance)
+        return sort_transactions(queryset, self.request.query_params)
 
-        # sorting logic
-
-        # TODO: sort by amount normalized currency values once we have that implemented
-        sort_by = self.request.query_params.get('sort_by')
-        order = self.request.query_params.get('order')  # 'asc'/'desc'
-        allowed_sort_fields = ['date', 'amount']
-        allowed_order_fields = ['asc', 'desc']
-
-        if not sort_by or sort_by not in allowed_sort_fields: sort_by = 'date'
-        if not order or order not in allowed_order_fields: order = 'desc'
-
-        if order == 'desc': sort_by = '-' + sort_by
-
-        queryset = queryset.order_by(sort_by)
-        return queryset
-
+    @atomic
     def perform_create(self, serializer):  # Override to update balance on transaction creation
         balance_id = self.kwargs["pk"]
         balance = Balance.objects.get(pk=balance_id)
@@ -65,6 +75,43 @@ class TransactionList(generics.ListCreateAPIView):
         transaction = serializer.save(user=self.request.user, balance=balance)
         balance.amount += transaction.amount
         balance.save()
+        update_category_rollups([transaction])
+        refresh_balance_snapshots(balance, since=timezone.localdate(transaction.date))
+
+
+class Ledger(generics.ListAPIView):
+    # Every transaction the user owns, across balances; only the UAH amount is comparable here
+    serializer_class = TransactionSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        queryset = Transaction.objects.filter(user=self.request.user)
+        return sort_transactions(queryset, self.request.query_params, allowed_sort_fields=('date', 'amount_uah'))
+
+
+class TransactionExport(APIView):
+    # `format` is taken by DRF's content negotiation, hence `file_format`
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk=None):
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in EXPORT_FORMATS:
+            raise ValidationError({"file_format": f"Must be one of {', '.join(EXPORT_FORMATS)}."})
+
+        queryset = Transaction.objects.filter(user=request.user)
+        filename = 'transactions'
+        if pk is not None:
+            balance = Balance.objects.filter(pk=pk, user=request.user).first()
+            if not balance:
+                raise Http404
+            queryset = queryset.filter(balance=balance)
+            filename = f'balance-{balance.pk}-transactions'
+
+        response = StreamingHttpResponse(stream_export(queryset, file_format),
+                                         content_type=EXPORT_FORMATS[file_format])
+        response['Content-Disposition'] = f'attachment; filename="{filename}.{file_format}"'
+        return response
 
 
 class TransactionDetail(generics.RetrieveUpdateDestroyAPIView):
@@ -74,11 +121,15 @@ class TransactionDetail(generics.RetrieveUpdateDestroyAPIView):
     def get_queryset(self):
         return Transaction.objects.filter(user=self.request.user)
 
+    @atomic
     def perform_update(self, serializer):
         instance = serializer.instance
         old_transaction = Transaction.objects.get(pk=instance.pk)
         old_balance = old_transaction.balance
-        transaction = serializer.save()
+        data = serializer.validated_data
+        amount_uah = convert_at(data.get('amount', instance.amount), old_balance.currency_id,
+                                data.get('date', instance.date))
+        transaction = serializer.save(amount_uah=amount_uah)
 
         balance = transaction.balance
 
@@ -89,12 +140,26 @@ class TransactionDetail(generics.RetrieveUpdateDestroyAPIView):
         balance.amount += transaction.amount
         balance.save()
 
+        update_category_rollups([old_transaction], sign=-1)
+        update_category_rollups([transaction])
+
+        old_day = timezone.localdate(old_transaction.date)
+        new_day = timezone.localdate(transaction.date)
+        if old_balance.pk == balance.pk:
+            refresh_balance_snapshots(balance, since=min(old_day, new_day))
+        else:
+            refresh_balance_snapshots(old_balance, since=old_day)
+            refresh_balance_snapshots(balance, since=new_day)
+
+    @atomic
     def perform_destroy(self, instance):
         balance = instance.balance
 
         balance.amount -= instance.amount
         balance.save()
+        update_category_rollups([instance], sign=-1)
         instance.delete()
+        refresh_balance_snapshots(balance, since=timezone.localdate(instance.date))
 
 
 class BalanceList(generics.ListCreateAPIView):
@@ -111,10 +176,12 @@ class BalanceList(generics.ListCreateAPIView):
 
         return Balance.objects.filter(user=self.request.user)
 
+    @atomic
     def perform_create(self, serializer):  # override to set user on balance creation
         if not serializer.validated_data.get('currency'):
             raise ValidationError({"currency": "Currency must be specified."})
-        serializer.save(user=self.request.user)
+        balance = serializer.save(user=self.request.user)
+        refresh_balance_snapshots(balance, since=timezone.localdate())
 
 
 class BalanceDetail(generics.RetrieveUpdateDestroyAPIView):
@@ -126,63 +193,174 @@ class BalanceDetail(generics.RetrieveUpdateDestroyAPIView):
     def get_queryset(self):
         return Balance.objects.filter(user=self.request.user)
 
+    @atomic
+    def perform_update(self, serializer):
+        # Stored transactions carry their UAH value at the balance's currency, and the rollups are
+        # built from it, so the currency is fixed once there are any
+        currency = serializer.validated_data.get('currency', serializer.instance.currency)
+        currency_changed = currency.pk != serializer.instance.currency_id
+        if currency_changed and Transaction.objects.filter(balance=serializer.instance).exists():
+            raise ValidationError({"currency": "The currency of a balance with transactions can't be changed."})
+        balance = serializer.save()
+        # A manual correction of the amount moves the whole history by the same difference; a new
+        # currency revalues all of it
+        refresh_balance_snapshots(balance, since=None if currency_changed else timezone.localdate())
+
+    @atomic
+    def perform_destroy(self, instance):
+        # The cascade takes the transactions with it, but the rollups are per user
+        update_category_rollups(instance.transaction_set.only(*ROLLUP_FIELDS), sign=-1)
+        instance.delete()
+
 
 class BalanceSumm(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        user = request.user
-        balances = Balance.objects.filter(user=user)
-        total_amount = sum(balance.amount * balance.currency.rate for balance in balances)
-        return Response({'total_amount_uah': total_amount})
+        # One query: the window sum gives the per-currency subtotals alongside every balance row,
+        # conversion goes through the in-memory rate table
+        rows = Balance.objects.filter(user=request.user).annotate(
+            currency_amount=Window(Sum('amount'), partition_by=[F('currency')]),
+        ).values('id', 'name', 'currency', 'amount', 'currency_amount').order_by('id')
+
+        by_currency = {}
+        balances = []
+        for row in rows:
+            by_currency[row['currency']] = {
+                'currency': row['currency'],
+                'amount': row['currency_amount'],
+                'amount_uah': convert(row['currency_amount'], row['currency']),
+            }
+            balances.append({
+                'id': row['id'],
+                'name': row['name'],
+                'currency': row['currency'],
+                'amount': row['amount'],
+                'amount_uah': convert(row['amount'], row['currency']),
+            })
+
+        total_amount = sum((item['amount_uah'] for item in by_currency.values()), Decimal(0))
+        return Response({
+            'total_amount_uah': total_amount,
+            'by_currency': list(by_currency.values()),
+            'balances': balances,
+        })
+
+
+class BalanceHistory(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        end = parse_date_param(request, 'end', timezone.localdate())
+        start = parse_date_param(request, 'start', end - timedelta(days=30))
+        if start > end:
+            raise ValidationError({"start": "Must not be after end."})
+
+        balance_id = request.query_params.get('balance_id')
+        if balance_id is not None:
+            balance = Balance.objects.filter(pk=balance_id, user=request.user).first()
+            if not balance:
+                raise Http404
+
+        history = net_worth_history(request.user, start, end, balance_id)
+        return Response({'start': start, 'end': end, 'history': history})
+
+
+class CategoryBreakdown(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        end = parse_date_param(request, 'end', timezone.localdate())
+        start = parse_date_param(request, 'start', end.replace(day=1))
+        group_by = request.query_params.get('group_by')
+        if group_by not in (None, 'month'):
+            raise ValidationError({"group_by": "Only 'month' is supported."})
+
+        categories = category_breakdown(request.user, start, end, by_month=group_by == 'month')
+        return Response({'start': start, 'end': end, 'categories': categories})
 
 
 class ProcessFileUpload(APIView):
+    # The import itself runs in the background; poll import/<id>/ for its progress
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
         serializer = FileUploadSerializer(data=request.data)
         if serializer.is_valid():
             file = serializer.validated_data['file']
-            # try:
             balance_id = request.query_params.get('balance_id')
-            balance = Balance.objects.get(pk=balance_id)
-            if not balance or not (balance.user == request.user):
+            balance = Balance.objects.filter(pk=balance_id, user=request.user).first()
+            if not balance:
                 raise Http404
-            import_transaction_file(file, request.user, balance)
-            return Response({'status': 'file processed successfully'})
-            # except Exception as e:
-            #    return Response({'error': str(e)}, status=400)
+            self.check_file(file)
+            job = ImportJob.objects.create(user=request.user, balance=balance, file=file)
+            enqueue_import(job)
+            return Response(ImportJobSerializer(job).data, status=202)
         return Response(serializer.errors, status=400)
 
+    def check_file(self, file):
+        # Only the first few KB are looked at; the import itself happens in the background
+        from finances.parsers import detect_parser
+        if detect_parser(file) is None:
+            raise ValidationError({"file": "Unsupported statement format"})
+
+
+class ProcessArchiveUpload(ProcessFileUpload):
+    # A zip of statements, imported as one job; the job reports per-file stats once done
+
+    def check_file(self, file):
+        from finances.archives import recognised_statements
+        if not file.name.lower().endswith('.zip'):
+            raise ValidationError({"file": "Expected a .zip archive"})
+        if not recognised_statements(file):
+            raise ValidationError({"file": "No supported statements in the archive"})
+
+
+class ImportJobDetail(generics.RetrieveAPIView):
+    serializer_class = ImportJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return ImportJob.objects.filter(user=self.request.user)
+
 
 class RefreshExchangeRates(APIView):
+    permission_classes = [IsAuthenticated]
 
     def post(self, request):
-        from finances.tasks import fetch_exchange_rates
-        from finances.tasks import fetch_crypto_rates
-        # fetch_exchange_rates()
-        fetch_crypto_rates()
-        return Response({'status': 'exchange rates refreshed successfully'})
+        refreshed = refresh_rates_once(settings.RATES_MIN_REFRESH_INTERVAL)
+        if refreshed is not None:
+            return Response({'status': 'exchange rates refreshed successfully', 'refreshed': refreshed})
+        # A request that finds a refresh running waits a little for it instead of starting another;
+        # the one it waited for is the refresh it asked for
+        finished = await_refresh(settings.RATES_REFRESH_WAIT)
+        if finished:
+            return Response({'status': 'exchange rates refreshed successfully'})
+        if finished is False:
+            return Response({'status': 'exchange rates are being refreshed'}, status=202)
+        return Response({'status': 'exchange rates were refreshed recently'}, status=429,
+                        headers={'Retry-After': str(settings.RATES_MIN_REFRESH_INTERVAL)})
 
 
 class CurrencyList(generics.ListAPIView):
     serializer_class = CurrencySerializer
     permission_classes = [AllowAny]
 
+    def list(self, request, *args, **kwargs):
+        # Always answers from the table as it is; stale rates are refreshed in the background and
+        # the headers say how fresh the answer is
+        response = super().list(request, *args, **kwargs)
+        updated = rates_updated_at()
+        stale = rates_stale(updated)
+        if stale:
+            refresh_in_background()
+        if updated is not None:
+            response['Last-Modified'] = http_date(updated.timestamp())
+        response['X-Rates-Stale'] = 'true' if stale else 'false'
+        return response
+
     def get_queryset(self):
         queryset = Currency.objects.all()
-        update = False
-
-        try:
-            uah = queryset.get(alpha_code='UAH')
-            update = uah.updated.timestamp() < timezone.now().timestamp() - 3600
-        except Currency.DoesNotExist:
-            update = True
-
-        if update:
-            fetch_exchange_rates()
-            fetch_crypto_rates()
 
         search = self.request.query_params.get('search')
         if search is not None:
@@ -193,15 +371,53 @@ class CurrencyList(generics.ListAPIView):
         return queryset
 
 
+def parse_datetime_param(request, name, default=None):
+    # Accepts either a full ISO datetime or a bare date (taken as midnight)
+    value = request.query_params.get(name)
+    if not value:
+        return default
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValidationError({name: "Expected an ISO date or datetime."})
+        parsed = datetime.combine(day, time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def parse_date_param(request, name, default=None):
+    value = request.query_params.get(name)
+    if not value:
+        return default
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValidationError({name: "Expected an ISO date."})
+    return parsed
+
+
+class Cashflow(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        end = parse_datetime_param(request, 'end', timezone.now())
+        start = parse_datetime_param(request, 'start', end - timedelta(days=31))
+        bucket = request.query_params.get('bucket')
+        if bucket and bucket not in CASHFLOW_BUCKETS:
+            raise ValidationError({"bucket": f"Must be one of {', '.join(CASHFLOW_BUCKETS)}."})
+
+        result = cashflow(request.user, start, end, bucket or None)
+        return Response({'start': start, 'end': end, **result})
+
+
 @api_view(['GET'])
 def get_losses(request):
-    queryset = Transaction.objects.filter(user=request.user, date__gt=timezone.now() - timedelta(days=31), amount__lt=0)
-    total_losses = sum(transaction.amount * transaction.balance.currency.rate for transaction in queryset)
-    return Response({"losses": total_losses})
+    result = cashflow(request.user, start=timezone.now() - timedelta(days=31))
+    return Response({"losses": result['outflow']})
 
 
 @api_view(['GET'])
 def get_profits(request):
-    queryset = Transaction.objects.filter(user=request.user, date__gt=timezone.now() - timedelta(days=31), amount__gt=0)
-    total_profits = sum(transaction.amount * transaction.balance.currency.rate for transaction in queryset)
-    return Response({"profits": total_profits})
+    result = cashflow(request.user, start=timezone.now() - timedelta(days=31))
+    return Response({"profits": result['inflow']})
@@ -3,7 +3,8 @@ from datetime import datetime, timedelta
 from datetime import timezone as tz
 from django.utils import timezone
 
-import requests
+from django.conf import settings
+from django.db.transaction import atomic
 from rest_framework import generics
 from rest_framework.decorators import api_view
 from rest_framework.exceptions import ValidationError
@@ -11,7 +12,11 @@ from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from finances import http_client
 from finances.models import Currency, Balance
+from finances.rates import normalize_amounts
+from finances.rollups import ROLLUP_FIELDS, update_category_rollups
+from finances.snapshots import refresh_balance_snapshots
 from monobank.models import MonobankUser, MonobankBalance, MonobankTransaction
 from monobank.serializers import TokenSerializer, MonobankBalanceSerializer
 
@@ -19,13 +24,13 @@ from monobank.serializers import TokenSerializer, MonobankBalanceSerializer
 # Create your views here.
 
 def fetch_monobank_balances(token, user):
-    url = "https://api.monobank.ua/personal/client-info"
+    url = f"{settings.MONOBANK_API_URL}/personal/client-info"
     headers = {
         "Content-Type": "application/json",
         "X-Token": token,
     }
 
-    response = requests.get(url, headers=headers)
+    response = http_client.get(url, headers=headers)
     if response.ok:
         responseJson = response.json()
 
@@ -46,31 +51,49 @@ def fetch_monobank_balances(token, user):
 
 
 def fetch_monobank_report(token, balance_id, timestamp, user, adjust_balance=False):
-    url = f"https://api.monobank.ua/personal/statement/{balance_id}/{timestamp}"
+    url = f"{settings.MONOBANK_API_URL}/personal/statement/{balance_id}/{timestamp}"
     headers = {
         "Content-Type": "application/json",
         "X-Token": token,
     }
 
-    response = requests.get(url, headers=headers)
+    response = http_client.get(url, headers=headers)
     if response.ok:
         response_json = response.json()
-
-        for report in response_json:
-            balance = MonobankBalance.objects.get(monobank_id=balance_id).balance
-            MonobankTransaction.objects.create(
-                name=report["description"],
-                category='-',
-                monobank_id=report["id"],
-                date=datetime.fromtimestamp(report["time"], tz=tz.utc),
-                amount=report["amount"] / 100,
-                balance=balance,
-                user=user
-            )
+        if not response_json:
+            return
+
+        # Imported here so that loading the views does not build the MCC lookup tables
+        from finances.categories import get_categorizer
+        categories = get_categorizer().categorize_mccs([report.get("mcc") for report in response_json])
+
+        # One transaction for the whole statement: a single commit instead of one per row
+        with atomic():
+            balance = MonobankBalance.objects.select_related('balance').get(monobank_id=balance_id).balance
+            transactions = [
+                MonobankTransaction(
+                    name=report["description"],
+                    category=category,
+                    monobank_id=report["id"],
+                    date=datetime.fromtimestamp(report["time"], tz=tz.utc),
+                    amount=report["amount"] / 100,
+                    balance=balance,
+                    user=user
+                )
+                for report, category in zip(response_json, categories)
+            ]
             if adjust_balance:
-                balance.amount += decimal.Decimal(report["amount"] / 100)
+                balance.amount += decimal.Decimal(sum(report["amount"] for report in response_json)) / 100
                 balance.save()
 
+            # Multi-table inheritance rules out bulk_create, but the rates are still looked up once
+            for transaction in normalize_amounts(transactions):
+                transaction.save()
+
+            update_category_rollups(transactions)
+            earliest = min(report["time"] for report in response_json)
+            refresh_balance_snapshots(balance, since=timezone.localdate(datetime.fromtimestamp(earliest, tz=tz.utc)))
+
 
 class TokenView(generics.CreateAPIView, generics.DestroyAPIView):
     serializer_class = TokenSerializer
@@ -109,14 +132,17 @@ class MonobankBalanceWatch(generics.UpdateAPIView):
         instance = serializer.save()
 
         if instance.watch:
-            balance = Balance.objects.create(
-                name=instance.name,
-                user=self.request.user,
-                amount=instance.amount,
-                currency=instance.currency,
-            )
-            instance.balance = balance
-            instance.save()
+            with atomic():
+                balance = Balance.objects.create(
+                    name=instance.name,
+                    user=self.request.user,
+                    amount=instance.amount,
+                    currency=instance.currency,
+                )
+                # An empty statement books nothing, so today's row is made here rather than by the report
+                refresh_balance_snapshots(balance, since=timezone.localdate())
+                instance.balance = balance
+                instance.save()
 
             monobank_user = MonobankUser.objects.get(user=self.request.user)
             timestamp = int((timezone.now() - timedelta(days=31)).timestamp())
@@ -125,9 +151,12 @@ class MonobankBalanceWatch(generics.UpdateAPIView):
 
             monobank_user.save()
         else:
-            instance.balance.delete()
-            instance.balance = None
-            instance.save()
+            with atomic():
+                balance = instance.balance
+                update_category_rollups(balance.transaction_set.only(*ROLLUP_FIELDS), sign=-1)
+                balance.delete()
+                instance.balance = None
+                instance.save()
 
 
 @api_view(['GET'])
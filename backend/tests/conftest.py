@@ -1,10 +1,37 @@
+import json
 import pytest
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import urlsplit
 from django.contrib.auth.models import User
 from finances.models import Balance, Currency
+from finances import http_client, rates
 from rest_framework.test import APIClient
 from decimal import Decimal
 
 
+@pytest.fixture(scope='session')
+def django_db_modify_db_settings(django_db_modify_db_settings_parallel_suffix, tmp_path_factory):
+    # An on-disk test database rather than shared-cache memory, which fails concurrent writers with
+    # "table is locked" instead of letting them wait like production SQLite does
+    from django.conf import settings
+    settings.DATABASES['default']['TEST']['NAME'] = str(tmp_path_factory.mktemp('db') / 'test.sqlite3')
+
+
+@pytest.fixture(autouse=True)
+def rate_table(settings):
+    # Every test gets its own cache and a cold in-process rate table, and neither stale rates nor
+    # queued imports are worked on behind a test's back
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    settings.RATES_BACKGROUND_REFRESH = False
+    settings.IMPORT_WORKER_THREADS = 0
+    rates.invalidate()
+    yield
+    rates.invalidate()
+
+
 @pytest.fixture
 def api_client():
     yield APIClient()
@@ -50,4 +77,48 @@ def balance(user, currency):
         amount=Decimal(0.00), 
         currency=currency, 
         name="Main Wallet"
-    )
\ No newline at end of file
+    )
+
+@pytest.fixture
+def fake_upstream(settings):
+    # A local HTTP server standing in for Monobank and CoinGecko, behind a fresh shared client.
+    # routes maps a path to a list of (status, JSON body[, delay in seconds]) answered in turn, the
+    # last one repeating
+    routes = {}
+    seen = []
+    connections = set()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            path = urlsplit(self.path).path
+            seen.append(self.path)
+            connections.add(self.client_address)
+            answers = routes.get(path) or [(404, {"errorDescription": "not found"})]
+            status, body, *delay = answers.pop(0) if len(answers) > 1 else answers[0]
+            time.sleep(delay[0] if delay else 0)
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    # A client that timed out hangs up mid-answer; that's expected, not worth a traceback
+    server.handle_error = lambda request, client_address: None
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    settings.MONOBANK_API_URL = f"{url}/monobank"
+    settings.COINGECKO_API_URL = f"{url}/coingecko"
+    client = http_client.HttpClient(backoff_factor=0.01)
+    previous = http_client.set_client(client)
+    yield SimpleNamespace(routes=routes, requests=seen, connections=connections, client=client, host='127.0.0.1')
+    http_client.set_client(previous)
+    client.close()
+    server.shutdown()
+    server.server_close()
@@ -1,8 +1,14 @@
+import csv
+import io
+import json
 import pytest
 from rest_framework import status
 from finances.models import Transaction, Balance, Currency
+from finances.pagination import encode_cursor
 from django.contrib.auth.models import User
 from decimal import Decimal
+from datetime import timedelta
+from django.utils import timezone
 
 @pytest.mark.django_db
 def test_transaction_increases_balance(api_client, user, balance):
@@ -237,6 +243,29 @@ def test_create_transaction_changes_balance(api_client, user, balance):
     balance.refresh_from_db()
     assert balance.amount == initial_amount + transaction_amount
 
+@pytest.mark.django_db
+def test_balance_currency_is_fixed_once_it_has_transactions(api_client, user, balance, eur_currency):
+    """
+    Test that a balance without transactions can switch currency, but one with transactions
+    can't, since their stored UAH amounts were converted at the old currency.
+    """
+    api_client.force_authenticate(user=user)
+    response = api_client.patch(f"/balance/{balance.id}/", {'currency': 'eur'}, format="json")
+    assert response.status_code == status.HTTP_200_OK
+    balance.refresh_from_db()
+    assert balance.currency_id == 'eur'
+
+    api_client.post(f"/balance/{balance.id}/transactions/", {'name': 'Salary', 'category': 'Income', 'amount': 100},
+                    format="json")
+    response = api_client.patch(f"/balance/{balance.id}/", {'currency': 'usd', 'name': 'Renamed'}, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert 'currency' in response.data
+    balance.refresh_from_db()
+    assert (balance.currency_id, balance.name) == ('eur', 'Main Wallet')
+
+    assert api_client.patch(f"/balance/{balance.id}/", {'name': 'Renamed'}, format="json").status_code == \
+        status.HTTP_200_OK
+
 @pytest.mark.django_db
 def test_delete_transaction_updates_balance(api_client, user, balance):
     """
@@ -385,3 +414,207 @@ def test_currency_list_endpoint(api_client, user):
     assert response.status_code == status.HTTP_200_OK
     assert len(response.data) == 1
     assert response.data[0]['alpha_code'] == "BTC"
+
+@pytest.mark.django_db
+def test_balance_summation_breakdown(api_client, user, currency, eur_currency):
+    """
+    Test that the BalanceSumm API returns per-currency and per-balance breakdowns.
+    """
+    eur_currency.rate = Decimal("40.00")
+    eur_currency.save()
+
+    Balance.objects.create(user=user, amount=100.00, currency=currency, name="Cash")
+    Balance.objects.create(user=user, amount=50.00, currency=currency, name="Card")
+    Balance.objects.create(user=user, amount=5.00, currency=eur_currency, name="Travel")
+
+    api_client.force_authenticate(user=user)
+    response = api_client.get("/balance/summ/")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert Decimal(response.data['total_amount_uah']) == Decimal("350.00")
+
+    by_currency = {item['currency']: item for item in response.data['by_currency']}
+    assert Decimal(by_currency['usd']['amount']) == Decimal("150.00")
+    assert Decimal(by_currency['eur']['amount_uah']) == Decimal("200.00")
+
+    balances = {item['name']: item for item in response.data['balances']}
+    assert len(balances) == 3
+    assert Decimal(balances['Travel']['amount_uah']) == Decimal("200.00")
+
+
+@pytest.mark.django_db
+def test_balance_summation_query_count(api_client, user, currency, eur_currency, django_assert_num_queries):
+    """
+    Test that the BalanceSumm API runs a constant number of queries regardless of balance count.
+    """
+    for i in range(20):
+        Balance.objects.create(user=user, amount=i, currency=currency if i % 2 else eur_currency, name=f"B{i}")
+
+    api_client.force_authenticate(user=user)
+    api_client.get("/balance/summ/")  # warms the rate table
+    with django_assert_num_queries(1):
+        response = api_client.get("/balance/summ/")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.data['balances']) == 20
+
+
+@pytest.mark.django_db
+def test_cashflow_totals(api_client, user, balance, eur_currency):
+    """
+    Test that the cashflow API converts to UAH and splits inflow from outflow.
+    """
+    eur_currency.rate = Decimal("40.00")
+    eur_currency.save()
+    eur_balance = Balance.objects.create(user=user, amount=0, currency=eur_currency, name="Travel")
+
+    Transaction.objects.create(user=user, balance=balance, amount=Decimal("100.00"), name="Salary", category="C")
+    Transaction.objects.create(user=user, balance=balance, amount=Decimal("-30.00"), name="Food", category="C")
+    Transaction.objects.create(user=user, balance=eur_balance, amount=Decimal("-2.00"), name="Coffee", category="C")
+    Transaction.objects.create(user=user, balance=balance, amount=Decimal("-999.00"), name="Old", category="C",
+                               date=timezone.now() - timedelta(days=60))
+
+    api_client.force_authenticate(user=user)
+    response = api_client.get("/cashflow/")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert Decimal(response.data['inflow']) == Decimal("100.00")
+    assert Decimal(response.data['outflow']) == Decimal("-110.00")
+    assert Decimal(response.data['net']) == Decimal("-10.00")
+
+    response = api_client.get("/losses/")
+    assert Decimal(response.data['losses']) == Decimal("-110.00")
+    response = api_client.get("/profits/")
+    assert Decimal(response.data['profits']) == Decimal("100.00")
+
+
+@pytest.mark.django_db
+def test_cashflow_buckets(api_client, user, balance, django_assert_num_queries):
+    """
+    Test that the cashflow API groups by day in a single ledger query.
+    """
+    now = timezone.now()
+    for days_ago in range(3):
+        for _ in range(5):
+            Transaction.objects.create(user=user, balance=balance, amount=Decimal("-1.00"), name="T", category="C",
+                                       date=now - timedelta(days=days_ago))
+
+    api_client.force_authenticate(user=user)
+    api_client.get("/cashflow/")  # warms the rate table
+    with django_assert_num_queries(2):  # the ledger aggregation and the rate history
+        start = (now - timedelta(days=7)).date().isoformat()
+        response = api_client.get("/cashflow/", {'bucket': 'day', 'start': start})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.data['buckets']) == 3
+    assert all(Decimal(item['outflow']) == Decimal("-5.00") for item in response.data['buckets'])
+    assert Decimal(response.data['outflow']) == Decimal("-15.00")
+
+    response = api_client.get("/cashflow/", {'bucket': 'year'})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_list_transactions_cursor_pagination(api_client, user, balance):
+    """
+    Test that cursor mode walks the whole ledger without gaps or repeats, including ties.
+    """
+    for i in range(12):
+        Transaction.objects.create(user=user, balance=balance, amount=Decimal(i // 3), name=f"Tx {i}", category="C")
+
+    api_client.force_authenticate(user=user)
+    cases = [
+        ({'sort_by': 'amount', 'order': 'asc'}, ('amount', 'id')),
+        ({'sort_by': 'date', 'order': 'desc'}, ('-date', '-id')),
+    ]
+    for params, ordering in cases:
+        seen = []
+        response = api_client.get(f"/balance/{balance.id}/transactions/", {**params, 'cursor': '', 'page_size': 5})
+        while True:
+            assert response.status_code == status.HTTP_200_OK
+            assert 'count' not in response.data
+            seen += [item['id'] for item in response.data['results']]
+            if not response.data['next']:
+                break
+            response = api_client.get(response.data['next'])
+
+        assert seen == list(Transaction.objects.order_by(*ordering).values_list('id', flat=True))
+
+    response = api_client.get(f"/balance/{balance.id}/transactions/", {'cursor': 'garbage'})
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    # Well-formed, but not a date: the cursor belongs to another ordering or was tampered with
+    response = api_client.get(f"/balance/{balance.id}/transactions/",
+                              {'sort_by': 'date', 'cursor': encode_cursor('abc', 1)})
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    response = api_client.get(f"/balance/{balance.id}/transactions/",
+                              {'sort_by': 'amount', 'cursor': encode_cursor('abc', 1)})
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+def test_ledger_sorts_by_amount_uah_across_balances(api_client, user, balance, eur_currency):
+    """
+    Test that the unified ledger orders every balance of the user by the stored UAH amount.
+    """
+    other_user = User.objects.create_user(username='otheruser', password='password123')
+    eur_balance = Balance.objects.create(user=user, amount=0, currency=eur_currency, name="Travel")
+    other_balance = Balance.objects.create(user=other_user, amount=0, currency=eur_currency, name="Other")
+    Transaction.objects.create(user=user, balance=balance, amount=Decimal("100"), name="USD 100", category="C")
+    Transaction.objects.create(user=user, balance=eur_balance, amount=Decimal("95"), name="EUR 95", category="C")
+    Transaction.objects.create(user=user, balance=balance, amount=Decimal("-5"), name="USD -5", category="C")
+    Transaction.objects.create(user=other_user, balance=other_balance, amount=Decimal("1"), name="Not mine",
+                               category="C")
+
+    api_client.force_authenticate(user=user)
+    response = api_client.get("/transactions/", {'sort_by': 'amount_uah', 'order': 'desc'})
+    assert response.status_code == status.HTTP_200_OK
+    assert [item['name'] for item in response.data['results']] == ["EUR 95", "USD 100", "USD -5"]
+    assert Decimal(response.data['results'][0]['amount_uah']) == Decimal("104.5")
+
+    seen = []
+    response = api_client.get("/transactions/", {'sort_by': 'amount_uah', 'order': 'asc', 'cursor': '', 'page_size': 2})
+    while True:
+        seen += [item['name'] for item in response.data['results']]
+        if not response.data['next']:
+            break
+        response = api_client.get(response.data['next'])
+    assert seen == ["USD -5", "USD 100", "EUR 95"]
+
+    response = api_client.get(f"/balance/{eur_balance.id}/transactions/", {'sort_by': 'amount_uah'})
+    assert [item['name'] for item in response.data['results']] == ["EUR 95"]
+
+
+@pytest.mark.django_db
+def test_transaction_export_streams_csv_and_ndjson(api_client, user, balance, eur_currency):
+    """
+    Test that the exports stream every row of the requested scope, newest first.
+    """
+    eur_balance = Balance.objects.create(user=user, amount=0, currency=eur_currency, name="Travel")
+    now = timezone.now()
+    Transaction.objects.create(user=user, balance=balance, amount=Decimal("-12.5"), name='Lunch, "big"',
+                               category="Food", date=now - timedelta(days=1))
+    Transaction.objects.create(user=user, balance=eur_balance, amount=Decimal("10"), name="Refund", category="C",
+                               date=now)
+
+    api_client.force_authenticate(user=user)
+    response = api_client.get(f"/balance/{balance.id}/transactions/export/")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.streaming
+    assert response['Content-Type'] == 'text/csv'
+    rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+    assert rows[0] == ['id', 'date', 'name', 'category', 'amount', 'amount_uah', 'balance', 'currency']
+    assert len(rows) == 2
+    assert rows[1][2] == 'Lunch, "big"'
+    assert Decimal(rows[1][4]) == Decimal("-12.5")
+
+    response = api_client.get("/transactions/export/", {'file_format': 'ndjson'})
+    assert response.status_code == status.HTTP_200_OK
+    lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+    assert [line['name'] for line in lines] == ["Refund", 'Lunch, "big"']
+    assert lines[0]['currency'] == 'eur'
+    assert Decimal(lines[0]['amount_uah']) == Decimal("11")
+
+    assert api_client.get("/transactions/export/", {'file_format': 'xml'}).status_code == status.HTTP_400_BAD_REQUEST
+    other_user = User.objects.create_user(username='otheruser', password='password123')
+    api_client.force_authenticate(user=other_user)
+    assert api_client.get(f"/balance/{balance.id}/transactions/export/").status_code == status.HTTP_404_NOT_FOUND
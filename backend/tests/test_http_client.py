@@ -0,0 +1,32 @@
+import pytest
+import requests
+from finances import http_client
+
+
+def test_client_retries_server_errors_and_keeps_the_connection(fake_upstream, settings):
+    """
+    Test that a 503 is retried on the same pooled connection and that the host's counters see
+    one call that succeeded.
+    """
+    url = f"{settings.MONOBANK_API_URL}/bank/currency"
+    fake_upstream.routes["/monobank/bank/currency"] = [(503, {}), (200, [{"currencyCodeA": 840}])]
+
+    assert http_client.get(url).json() == [{"currencyCodeA": 840}]
+    assert http_client.get(url).status_code == 200
+    assert len(fake_upstream.requests) == 3
+
+    assert len(fake_upstream.connections) == 1
+    stats = fake_upstream.client.stats()[fake_upstream.host]
+    assert (stats['requests'], stats['failures']) == (2, 0)
+    assert stats['max_seconds'] >= stats['mean_seconds'] > 0
+
+
+def test_client_gives_up_on_a_hung_upstream(fake_upstream, settings, monkeypatch):
+    monkeypatch.setattr(http_client, 'DEFAULT_TIMEOUT', (1, 0.1))
+    fake_upstream.routes["/coingecko/coins/markets"] = [(200, [], 0.5)]
+
+    with pytest.raises(requests.RequestException):
+        http_client.get(f"{settings.COINGECKO_API_URL}/coins/markets")
+    # Timed out once, not once per retry
+    assert len(fake_upstream.requests) == 1
+    assert fake_upstream.client.stats()[fake_upstream.host]['failures'] == 1
@@ -0,0 +1,150 @@
+import pytest
+import zipfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest.mock import patch
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError
+from django.utils import timezone
+from rest_framework import status
+from finances.jobs import run_pending_jobs
+from finances.models import Balance, ImportJob, Transaction
+from finances.tasks import import_transaction_file
+
+STATEMENT = Path(__file__).parent / "static" / "monobank_statement.csv"
+
+
+@pytest.fixture(autouse=True)
+def import_settings(settings, tmp_path):
+    # No worker threads: jobs stay queued until the test runs them in-process
+    settings.MEDIA_ROOT = tmp_path
+    settings.IMPORT_WORKER_THREADS = 0
+
+
+def upload(api_client, balance, name="statement.csv", content=None, endpoint="/import/"):
+    file_obj = SimpleUploadedFile(name, STATEMENT.read_bytes() if content is None else content)
+    return api_client.post(f"{endpoint}?balance_id={balance.id}", {'file': file_obj}, format="multipart")
+
+
+@pytest.mark.django_db
+def test_import_endpoint_queues_a_job_and_reports_progress(api_client, user, balance):
+    """
+    Test that an upload returns 202 at once and that the job status follows the worker.
+    """
+    api_client.force_authenticate(user=user)
+    response = upload(api_client, balance)
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.data['status'] == ImportJob.PENDING
+    assert Transaction.objects.count() == 0
+
+    job_url = f"/import/{response.data['id']}/"
+    assert api_client.get(job_url).data['status'] == ImportJob.PENDING
+
+    assert run_pending_jobs() == 1
+    data = api_client.get(job_url).data
+    assert data['status'] == ImportJob.DONE
+    assert data['rows_parsed'] == 5
+    assert data['rows_inserted'] == 5
+    assert data['finished'] is not None
+    assert Transaction.objects.filter(balance=balance).count() == 5
+    assert not ImportJob.objects.get().file
+
+    api_client.force_authenticate(user=None)
+    assert api_client.get(job_url).status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.django_db
+def test_failed_import_job_records_the_error(api_client, user, balance):
+    api_client.force_authenticate(user=user)
+    response = upload(api_client, balance, content=b"date,amount\nsometime,1\n")
+    assert response.status_code == status.HTTP_202_ACCEPTED
+
+    out = StringIO()
+    call_command('run_import_worker', '--once', stdout=out)
+    assert "Ran 1 import job(s)" in out.getvalue()
+
+    job = ImportJob.objects.get()
+    assert job.status == ImportJob.FAILED
+    assert job.error
+    assert job.rows_inserted == 0
+    assert Transaction.objects.count() == 0
+
+    assert upload(api_client, balance, name="statement.pdf").status_code == status.HTTP_400_BAD_REQUEST
+    assert upload(api_client, balance, content=b"no,useful,columns\n1,2,3\n").status_code == \
+        status.HTTP_400_BAD_REQUEST
+
+
+
+@pytest.mark.django_db
+def test_jobs_survive_a_failed_claim_and_a_dead_worker(api_client, user, balance, caplog):
+    """
+    Test that a job the worker could not claim stays pending for the next poll, and that a job
+    left running by a worker that went away is taken over once IMPORT_JOB_TIMEOUT has passed.
+    """
+    api_client.force_authenticate(user=user)
+    upload(api_client, balance)
+
+    with patch('finances.jobs.claim_job', side_effect=OperationalError("database is locked")):
+        assert run_pending_jobs() == 0
+    assert "could not run a job" in caplog.text
+    assert ImportJob.objects.get().status == ImportJob.PENDING
+
+    ImportJob.objects.update(status=ImportJob.RUNNING, started=timezone.now())
+    assert run_pending_jobs() == 0
+
+    ImportJob.objects.update(started=timezone.now() - timedelta(hours=2))
+    assert run_pending_jobs() == 1
+    assert ImportJob.objects.get().status == ImportJob.DONE
+    assert Transaction.objects.filter(balance=balance).count() == 5
+
+@pytest.mark.django_db
+def test_import_reports_progress_per_chunk(user, balance):
+    calls = []
+    file_obj = SimpleUploadedFile("statement.csv", STATEMENT.read_bytes())
+    import_transaction_file(file_obj, user, balance, chunk_size=2, progress=lambda *counts: calls.append(counts))
+    assert calls == [(2, 2), (4, 4), (5, 5)]
+
+
+def statement_archive(files):
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, content in files.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+@pytest.mark.django_db
+def test_archive_import_merges_overlapping_statements(api_client, user, balance, settings):
+    """
+    Test that the statements in a zip are parsed in worker processes, that a row found in two of
+    them is imported once, and that the job reports stats per file.
+    """
+    settings.IMPORT_PROCESSES = 2
+    header, *rows = STATEMENT.read_text().splitlines()
+    content = statement_archive({
+        "2025-12-older.csv": "\n".join([header] + rows[2:]),
+        "2025-12-newer.csv": "\n".join([header] + rows[:3]),
+        "notes.txt": "not a statement",
+        "__MACOSX/._2025-12-older.csv": "resource fork",
+    })
+    api_client.force_authenticate(user=user)
+    response = upload(api_client, balance, name="statements.zip", content=content, endpoint="/import/archive/")
+    assert response.status_code == status.HTTP_202_ACCEPTED
+
+    assert run_pending_jobs() == 1
+    job = ImportJob.objects.get()
+    assert job.status == ImportJob.DONE
+    assert (job.rows_parsed, job.rows_inserted, job.rows_skipped) == (6, 5, 1)
+    assert [(file['name'], file['parsed'], file['inserted'], file['skipped']) for file in job.files] == [
+        ("2025-12-older.csv", 3, 3, 0), ("2025-12-newer.csv", 3, 2, 1), ("notes.txt", 0, 0, 0)]
+    assert job.files[0]['parser'] == "Monobank CSV"
+    assert job.files[2]['error']
+    assert Transaction.objects.filter(balance=balance).count() == 5
+    # The running balance comes from the statement with the newest row, whatever the order in the zip
+    assert Balance.objects.get(pk=balance.pk).amount == 5000
+
+    assert upload(api_client, balance, endpoint="/import/archive/").status_code == status.HTTP_400_BAD_REQUEST
+    assert upload(api_client, balance, name="notes.zip", content=statement_archive({"notes.txt": "nothing"}),
+                  endpoint="/import/archive/").status_code == status.HTTP_400_BAD_REQUEST
@@ -0,0 +1,103 @@
+import re
+import pytest
+from datetime import timedelta
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from finances.models import Transaction
+from finances.rates import normalize_amounts
+
+# Tables that grow with the ledger; reading any of them end to end is a regression
+LEDGER_TABLES = {
+    'finances_transaction', 'finances_balancesnapshot', 'finances_categoryrollup', 'finances_currencyrate',
+}
+FULL_SCAN = re.compile(r'^SCAN (\w+)')
+
+
+def query_plans(client, url, params=None):
+    """
+    Call an endpoint and return (sql, EXPLAIN QUERY PLAN details) for every query it ran.
+    """
+    with CaptureQueriesContext(connection) as captured:
+        response = client.get(url, params)
+    assert response.status_code == 200, response.data
+
+    plans = []
+    with connection.cursor() as cursor:
+        for query in captured.captured_queries:
+            cursor.execute("EXPLAIN QUERY PLAN " + query['sql'])
+            plans.append((query['sql'], [row[3] for row in cursor.fetchall()]))
+    return plans
+
+
+def assert_no_full_scans(plans):
+    for sql, details in plans:
+        for detail in details:
+            match = FULL_SCAN.match(detail)
+            assert not (match and match.group(1) in LEDGER_TABLES), f"Full scan ({detail}) in: {sql}"
+
+
+@pytest.fixture
+def ledger(user, balance):
+    now = timezone.now()
+    Transaction.objects.bulk_create(normalize_amounts([
+        Transaction(user=user, balance=balance, amount=i - 10, name=f"T{i}", category=f"C{i % 3}",
+                    date=now - timedelta(days=i))
+        for i in range(20)
+    ]))
+    return balance
+
+
+@pytest.mark.skipif(connection.vendor != 'sqlite', reason="EXPLAIN QUERY PLAN is SQLite syntax")
+@pytest.mark.django_db
+@pytest.mark.parametrize("sort_by", ['date', 'amount', 'amount_uah'])
+@pytest.mark.parametrize("order", ['asc', 'desc'])
+@pytest.mark.parametrize("cursor", [None, ''])
+def test_transaction_list_is_served_from_an_index(api_client, user, ledger, sort_by, order, cursor):
+    api_client.force_authenticate(user=user)
+    params = {'sort_by': sort_by, 'order': order, 'page_size': 5}
+    if cursor is not None:
+        params['cursor'] = cursor
+    url = f"/balance/{ledger.id}/transactions/"
+    plans = query_plans(api_client, url, params)
+    if cursor is not None:
+        # follow one cursor so the keyset range filter is covered too
+        plans += query_plans(api_client, api_client.get(url, params).data['next'])
+
+    assert_no_full_scans(plans)
+    for sql, details in plans:
+        if 'FROM "finances_transaction"' in sql and 'ORDER BY' in sql:
+            assert 'USE TEMP B-TREE FOR ORDER BY' not in details, f"Sorts the whole balance: {sql}"
+
+
+@pytest.mark.skipif(connection.vendor != 'sqlite', reason="EXPLAIN QUERY PLAN is SQLite syntax")
+@pytest.mark.django_db
+@pytest.mark.parametrize("sort_by", ['date', 'amount_uah'])
+@pytest.mark.parametrize("order", ['asc', 'desc'])
+def test_unified_ledger_is_served_from_an_index(api_client, user, ledger, sort_by, order):
+    api_client.force_authenticate(user=user)
+    params = {'sort_by': sort_by, 'order': order, 'page_size': 5, 'cursor': ''}
+    plans = query_plans(api_client, "/transactions/", params)
+    plans += query_plans(api_client, api_client.get("/transactions/", params).data['next'])
+
+    assert_no_full_scans(plans)
+    for sql, details in plans:
+        if 'FROM "finances_transaction"' in sql and 'ORDER BY' in sql:
+            assert 'USE TEMP B-TREE FOR ORDER BY' not in details, f"Sorts the whole ledger: {sql}"
+
+
+@pytest.mark.skipif(connection.vendor != 'sqlite', reason="EXPLAIN QUERY PLAN is SQLite syntax")
+@pytest.mark.django_db
+@pytest.mark.parametrize("url, params", [
+    ("/balance/", None),
+    ("/balance/summ/", None),
+    ("/balance/history/", None),
+    ("/cashflow/", None),
+    ("/cashflow/", {'bucket': 'week'}),
+    ("/losses/", None),
+    ("/profits/", None),
+    ("/categories/", {'group_by': 'month'}),
+])
+def test_reports_do_not_scan_the_ledger(api_client, user, ledger, url, params):
+    api_client.force_authenticate(user=user)
+    assert_no_full_scans(query_plans(api_client, url, params))
@@ -0,0 +1,199 @@
+import pytest
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from decimal import Decimal
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+from finances import leases, rates
+from finances.models import Balance, Currency, CurrencyRate, Transaction
+
+
+@pytest.mark.django_db
+def test_convert_uses_in_process_table(currency, eur_currency, django_assert_num_queries):
+    assert rates.convert(10, 'eur') == Decimal("11.0")
+
+    with django_assert_num_queries(0):
+        assert rates.convert(Decimal("2"), eur_currency) == Decimal("2.2")
+        assert rates.convert(Decimal("11"), 'eur', 'usd') == Decimal("12.1")
+
+    with pytest.raises(Currency.DoesNotExist):
+        rates.convert(1, 'xyz')
+
+
+@pytest.mark.django_db
+def test_rate_table_reloads_on_new_version(eur_currency, monkeypatch):
+    assert rates.get_rate('eur') == Decimal("1.1")
+
+    Currency.objects.filter(pk='eur').update(rate=Decimal("42"))
+    assert rates.get_rate('eur') == Decimal("1.1")
+
+    # Another process published a refresh: seen once the check interval has passed
+    cache.set(rates.VERSION_CACHE_KEY, 'other-process')
+    monkeypatch.setattr(rates, 'VERSION_CHECK_INTERVAL', 0)
+    assert rates.get_rate('eur') == Decimal("42")
+
+    Currency.objects.filter(pk='eur').update(rate=Decimal("43"))
+    rates.bump_version()
+    assert rates.get_rate('eur') == Decimal("43")
+
+
+@pytest.mark.django_db
+def test_rate_history_as_of_lookups(eur_currency, django_assert_num_queries):
+    now = timezone.now()
+    for days_ago, rate in [(10, "30"), (5, "35"), (1, "40")]:
+        CurrencyRate.objects.create(currency=eur_currency, timestamp=now - timedelta(days=days_ago), rate=Decimal(rate))
+
+    with django_assert_num_queries(1):
+        history = rates.RateHistory(['eur'], start=now - timedelta(days=6))
+    assert history.rate_at('eur', now - timedelta(days=6)) == Decimal("30")
+    assert history.rate_at('eur', now - timedelta(days=3)) == Decimal("35")
+    assert history.rate_at('eur', now) == Decimal("40")
+    # a bare date means the close of that day
+    assert history.rate_at('eur', (now - timedelta(days=5)).date()) == Decimal("35")
+    converted = history.convert_many([(2, 'eur', now), (2, 'eur', now - timedelta(days=3))])
+    assert converted == [Decimal("80"), Decimal("70")]
+
+
+@pytest.mark.django_db
+def test_cashflow_converts_at_transaction_date(api_client, user, eur_currency):
+    now = timezone.now()
+    CurrencyRate.objects.create(currency=eur_currency, timestamp=now - timedelta(days=20), rate=Decimal("30"))
+    CurrencyRate.objects.create(currency=eur_currency, timestamp=now - timedelta(days=2), rate=Decimal("50"))
+    balance = Balance.objects.create(user=user, amount=0, currency=eur_currency, name="EUR")
+    Transaction.objects.create(user=user, balance=balance, amount=Decimal("-1"), name="Old", category="C",
+                               date=now - timedelta(days=10))
+    Transaction.objects.create(user=user, balance=balance, amount=Decimal("-1"), name="New", category="C", date=now)
+
+    api_client.force_authenticate(user=user)
+    response = api_client.get("/cashflow/")
+    assert Decimal(response.data['outflow']) == Decimal("-80")
+
+
+@pytest.mark.django_db
+def test_stale_currency_list_refreshes_in_the_background(api_client, settings, monkeypatch):
+    """
+    Test that a read of stale rates answers at once from the table and starts a single refresh.
+    """
+    settings.RATES_BACKGROUND_REFRESH = True
+    Currency.objects.create(id="UAH", alpha_code="UAH", num_code=980, name="Hryvnia", rate=1)
+    Currency.objects.filter(pk="UAH").update(updated=timezone.now() - timedelta(hours=2))
+    release = threading.Event()
+    calls = []
+    monkeypatch.setattr(rates, 'refresh_rates_once', lambda min_interval: calls.append(1) or release.wait(5))
+
+    first = api_client.get("/currencies/")
+    second = api_client.get("/currencies/")
+    assert first.status_code == second.status_code == 200
+    assert len(first.data) == 1
+    assert first['X-Rates-Stale'] == "true"
+    assert first['Last-Modified']
+    assert not rates.refresh_in_background()  # still running
+
+    release.set()
+    for thread in threading.enumerate():
+        if thread.name == 'rates-refresh':
+            thread.join(5)
+    assert calls == [1]
+
+    Currency.objects.filter(pk="UAH").update(updated=timezone.now())
+    assert api_client.get("/currencies/")['X-Rates-Stale'] == "false"
+
+
+@pytest.mark.django_db
+def test_refresh_rates_command_runs_both_sources(monkeypatch):
+    calls = []
+
+    def fetch_crypto_rates():
+        raise ValueError("COINGECKO_API_KEY environment variable not set")
+
+    monkeypatch.setattr('finances.tasks.fetch_exchange_rates', lambda: calls.append('fiat'))
+    monkeypatch.setattr('finances.tasks.fetch_crypto_rates', fetch_crypto_rates)
+
+    out = StringIO()
+    call_command('refresh_rates', '--once', stdout=out)
+    assert calls == ['fiat']
+    assert "Refreshed fiat rates" in out.getvalue()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_refreshes_run_upstream_once(monkeypatch):
+    """
+    Test that refreshes started together in several threads reach the rate sources only once.
+    """
+    calls = []
+
+    def fetch(source):
+        def run():
+            calls.append(source)
+            time.sleep(0.3)
+        return run
+
+    monkeypatch.setattr('finances.tasks.fetch_exchange_rates', fetch('fiat'))
+    monkeypatch.setattr('finances.tasks.fetch_crypto_rates', fetch('crypto'))
+    start = threading.Barrier(8)
+    results = []
+
+    def refresh():
+        try:
+            start.wait()
+            results.append(rates.refresh_rates_once())
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=refresh) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert sorted(calls) == ['crypto', 'fiat']
+    assert results.count(['fiat', 'crypto']) == 1
+    assert results.count(None) == 7
+    assert not leases.held(rates.REFRESH_LEASE)
+
+
+@pytest.mark.django_db
+def test_refresh_endpoint_needs_a_user_and_a_pause(api_client, user, monkeypatch):
+    calls = []
+    monkeypatch.setattr('finances.tasks.fetch_exchange_rates', lambda: calls.append('fiat'))
+    monkeypatch.setattr('finances.tasks.fetch_crypto_rates', lambda: calls.append('crypto'))
+
+    assert api_client.post("/exchange-rates/refresh/").status_code == 401
+
+    api_client.force_authenticate(user=user)
+    assert api_client.post("/exchange-rates/refresh/").status_code == 200
+    response = api_client.post("/exchange-rates/refresh/")
+    assert response.status_code == 429
+    assert response['Retry-After'] == "60"
+    assert calls == ['fiat', 'crypto']
+
+
+@pytest.mark.django_db(transaction=True)
+def test_refresh_endpoint_waits_briefly_for_a_running_refresh(api_client, user, settings):
+    """
+    Test that a request finding a refresh under way answers 200 once it finishes, or 202 when it
+    doesn't within RATES_REFRESH_WAIT, rather than 429 or waiting out RATES_REFRESH_TIMEOUT.
+    """
+    settings.RATES_REFRESH_WAIT = 0.5
+    api_client.force_authenticate(user=user)
+    token = leases.acquire(rates.REFRESH_LEASE, 300)
+    started = time.monotonic()
+    response = api_client.post("/exchange-rates/refresh/")
+    assert response.status_code == 202
+    assert time.monotonic() - started < 5
+
+    def finish_refresh():
+        try:
+            leases.release(rates.REFRESH_LEASE, token)
+        finally:
+            connection.close()
+
+    finish = threading.Timer(0.2, finish_refresh)
+    finish.start()
+    response = api_client.post("/exchange-rates/refresh/")
+    finish.join()
+    assert response.status_code == 200
@@ -0,0 +1,96 @@
+import pytest
+from io import StringIO
+from decimal import Decimal
+from pathlib import Path
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from rest_framework import status
+from finances.models import Balance, CategoryRollup, Transaction
+from finances.tasks import import_transaction_file
+from monobank.models import MonobankBalance, MonobankUser
+
+
+@pytest.mark.django_db
+def test_rollups_follow_transaction_writes(api_client, user, balance):
+    """
+    Test that API writes keep the per-month category rollups up to date.
+    """
+    api_client.force_authenticate(user=user)
+    for name, category, amount in [('A', 'Food', -40), ('B', 'Food', -10), ('C', 'Salary', 500)]:
+        api_client.post(f"/balance/{balance.id}/transactions/",
+                        {'name': name, 'category': category, 'amount': amount}, format="json")
+
+    food = CategoryRollup.objects.get(user=user, category='Food')
+    assert food.outflow == Decimal("-50.00")
+    assert food.count == 2
+
+    tx = Transaction.objects.get(name='A')
+    api_client.patch(f"/transactions/{tx.id}/", {'category': 'Transport'}, format="json")
+    food.refresh_from_db()
+    assert food.outflow == Decimal("-10.00")
+    assert CategoryRollup.objects.get(user=user, category='Transport').count == 1
+
+    api_client.delete(f"/transactions/{tx.id}/")
+    assert not CategoryRollup.objects.filter(user=user, category='Transport').exists()
+
+    response = api_client.get("/categories/")
+    assert response.status_code == status.HTTP_200_OK
+    categories = [item['category'] for item in response.data['categories']]
+    assert categories == ['Food', 'Salary']
+    assert Decimal(response.data['categories'][1]['inflow']) == Decimal("500.00")
+
+
+
+@pytest.mark.django_db
+def test_deleting_a_balance_takes_its_spending_out_of_the_rollups(api_client, user, balance, currency):
+    api_client.force_authenticate(user=user)
+    other = Balance.objects.create(user=user, amount=0, currency=currency, name="Savings")
+    api_client.post(f"/balance/{balance.id}/transactions/", {'name': 'Lunch', 'category': 'Food', 'amount': -50},
+                    format="json")
+    api_client.post(f"/balance/{other.id}/transactions/", {'name': 'Dinner', 'category': 'Food', 'amount': -20},
+                    format="json")
+
+    assert api_client.delete(f"/balance/{balance.id}/").status_code == status.HTTP_204_NO_CONTENT
+    assert not Transaction.objects.filter(balance_id=balance.id).exists()
+
+    response = api_client.get("/categories/")
+    assert [(item['category'], Decimal(item['outflow'])) for item in response.data['categories']] == \
+        [('Food', Decimal("-20.00"))]
+    assert CategoryRollup.objects.get(user=user, category='Food').count == 1
+
+@pytest.mark.django_db
+def test_rollups_include_bulk_import_and_match_ledger(user, balance):
+    """
+    Test that imported rows reach the rollups and that the rebuild command agrees with them.
+    """
+    csv_path = Path(__file__).parent / "static" / "monobank_statement.csv"
+    file_obj = SimpleUploadedFile("test_statement.csv", csv_path.read_bytes())
+    import_transaction_file(file_obj, user, balance)
+
+    assert sum(r.count for r in CategoryRollup.objects.filter(user=user)) == Transaction.objects.count()
+
+    out = StringIO()
+    call_command('rebuild_category_rollups', '--check', stdout=out)
+    assert "Rollups match the ledger" in out.getvalue()
+
+    CategoryRollup.objects.filter(user=user).update(count=0)
+    out = StringIO()
+    call_command('rebuild_category_rollups', stdout=out)
+    assert "had drifted" in out.getvalue()
+    assert sum(r.count for r in CategoryRollup.objects.filter(user=user)) == Transaction.objects.count()
+
+
+@pytest.mark.django_db
+def test_unwatching_a_monobank_balance_takes_its_spending_out_of_the_rollups(api_client, user, balance):
+    monobank_user = MonobankUser.objects.create(user=user, token="token")
+    watched = MonobankBalance.objects.create(balance=balance, currency=balance.currency, name="black",
+                                             user=monobank_user, monobank_id="acc", amount=0, watch=True)
+    api_client.force_authenticate(user=user)
+    api_client.post(f"/balance/{balance.id}/transactions/", {'name': 'Lunch', 'category': 'Food', 'amount': -50},
+                    format="json")
+
+    response = api_client.patch(f"/monobank/balances/{watched.id}/", {'watch': False}, format="json")
+    assert response.status_code == status.HTTP_200_OK
+    assert not Balance.objects.filter(pk=balance.pk).exists()
+    assert not CategoryRollup.objects.filter(user=user).exists()
+    assert api_client.get("/categories/").data['categories'] == []
@@ -0,0 +1,109 @@
+import pytest
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework import status
+from finances.models import BalanceSnapshot, Transaction
+from monobank import views as monobank_views
+from monobank.models import MonobankBalance, MonobankUser
+
+
+def snapshot_amounts(balance):
+    return {s.day: s.amount for s in BalanceSnapshot.objects.filter(balance=balance)}
+
+
+@pytest.mark.django_db
+def test_snapshots_follow_transaction_writes(api_client, user, balance):
+    """
+    Test that creating, editing and deleting transactions keeps the daily snapshots in step.
+    """
+    today = timezone.localdate()
+    three_days_ago = timezone.now() - timedelta(days=3)
+
+    api_client.force_authenticate(user=user)
+    api_client.post(f"/balance/{balance.id}/transactions/",
+                    {'name': 'Salary', 'category': 'Income', 'amount': 100.00, 'date': three_days_ago.isoformat()},
+                    format="json")
+    response = api_client.post(f"/balance/{balance.id}/transactions/",
+                               {'name': 'Food', 'category': 'Food', 'amount': -30.00}, format="json")
+    assert response.status_code == status.HTTP_201_CREATED
+
+    snapshots = snapshot_amounts(balance)
+    assert snapshots[today - timedelta(days=3)] == Decimal("100.00")
+    assert snapshots[today] == Decimal("70.00")
+
+    salary = Transaction.objects.get(name='Salary')
+    api_client.patch(f"/transactions/{salary.id}/", {'amount': 200.00}, format="json")
+    snapshots = snapshot_amounts(balance)
+    assert snapshots[today - timedelta(days=3)] == Decimal("200.00")
+    assert snapshots[today] == Decimal("170.00")
+
+    food = Transaction.objects.get(name='Food')
+    api_client.delete(f"/transactions/{food.id}/")
+    assert snapshot_amounts(balance)[today] == Decimal("200.00")
+
+
+@pytest.mark.django_db
+def test_backfill_matches_incremental_snapshots(api_client, user, balance):
+    """
+    Test that the backfill command rebuilds the same snapshots the write paths maintain.
+    """
+    api_client.force_authenticate(user=user)
+    for days_ago, amount in [(10, 500), (4, -120), (4, -30), (1, 75)]:
+        date = (timezone.now() - timedelta(days=days_ago)).isoformat()
+        api_client.post(f"/balance/{balance.id}/transactions/",
+                        {'name': 'T', 'category': 'C', 'amount': amount, 'date': date}, format="json")
+
+    incremental = snapshot_amounts(balance)
+    BalanceSnapshot.objects.all().delete()
+    call_command('backfill_balance_snapshots', stdout=None)
+
+    assert snapshot_amounts(balance) == incremental
+
+
+@pytest.mark.django_db
+def test_net_worth_history_endpoint(api_client, user, balance, eur_currency, django_assert_max_num_queries):
+    """
+    Test that the history endpoint forward-fills snapshots and converts to UAH.
+    """
+    eur_currency.rate = Decimal("40.00")
+    eur_currency.save()
+
+    api_client.force_authenticate(user=user)
+    api_client.post("/balance/", {'name': 'Travel', 'amount': 2, 'currency': eur_currency.id}, format="json")
+    date = (timezone.now() - timedelta(days=5)).isoformat()
+    api_client.post(f"/balance/{balance.id}/transactions/",
+                    {'name': 'T', 'category': 'C', 'amount': 100, 'date': date}, format="json")
+
+    start = timezone.localdate() - timedelta(days=6)
+    with django_assert_max_num_queries(3):
+        response = api_client.get("/balance/history/", {'start': start.isoformat()})
+
+    assert response.status_code == status.HTTP_200_OK
+    history = [Decimal(point['amount_uah']) for point in response.data['history']]
+    assert len(history) == 7
+    assert history[0] == Decimal(0)
+    assert history[1:6] == [Decimal("100.00")] * 5
+    assert history[6] == Decimal("180.00")
+
+
+@pytest.mark.django_db
+def test_watching_a_monobank_balance_snapshots_it_without_a_statement(api_client, user, currency, monkeypatch):
+    """
+    Test that a newly watched Monobank balance shows up in the history even when its statement
+    books nothing.
+    """
+    monkeypatch.setattr(monobank_views, 'fetch_monobank_report', lambda *args, **kwargs: None)
+    monobank_user = MonobankUser.objects.create(user=user, token="token")
+    account = MonobankBalance.objects.create(currency=currency, name="black", user=monobank_user,
+                                             monobank_id="acc", amount=Decimal("250.00"))
+    api_client.force_authenticate(user=user)
+
+    response = api_client.patch(f"/monobank/balances/{account.id}/", {'watch': True}, format="json")
+
+    assert response.status_code == status.HTTP_200_OK
+    account.refresh_from_db()
+    assert snapshot_amounts(account.balance) == {timezone.localdate(): Decimal("250.00")}
+    history = api_client.get("/balance/history/", {'start': timezone.localdate().isoformat()}).data['history']
+    assert Decimal(history[-1]['amount_uah']) == Decimal("250.00")
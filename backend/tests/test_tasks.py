@@ -1,28 +1,35 @@
+import io
+from contextlib import contextmanager
+import threading
 import pytest
-from unittest.mock import patch, Mock
+from unittest.mock import patch
 from decimal import Decimal
-from finances.tasks import fetch_crypto_rates, import_transaction_file
-from finances.models import Currency
+from finances.categories import get_categorizer
+from finances.parsers import SNIFF_BYTES, GenericCSV, MonobankCSV, detect_parser, header_mapping
+from finances.tasks import (TwinCounter, fetch_crypto_rates, fetch_exchange_rates, import_transaction_file,
+                            insert_new, read_transactions)
+from finances.models import Currency, CurrencyRate
 from django.core.files.uploadedfile import SimpleUploadedFile
-from finances.models import Transaction
+from django.db import connection
+from finances.models import Balance, CategoryRollup, Transaction
 from pathlib import Path
 import json
+import pandas as pd
+from openpyxl import Workbook
+from monobank.models import MonobankBalance, MonobankUser
+from monobank.views import fetch_monobank_report
 
 @pytest.mark.django_db
-@patch('finances.tasks.requests.get')
 @patch("finances.tasks.os.getenv")
 
-def test_fetch_crypto_rates_with_file_data(mock_getenv, mock_requests_get):
+def test_fetch_crypto_rates_with_file_data(mock_getenv, fake_upstream):
     
     mock_getenv.return_value = "fake_key"
 
     with open("tests/coingecko_response.json", "r") as f:
         real_data = json.load(f)
 
-    mock_response = Mock()
-    mock_response.status_code = 200
-    mock_response.json.return_value = real_data
-    mock_requests_get.return_value = mock_response
+    fake_upstream.routes["/coingecko/coins/markets"] = [(200, real_data)]
 
     fetch_crypto_rates()
 
@@ -38,6 +45,80 @@ def test_fetch_crypto_rates_with_file_data(mock_getenv, mock_requests_get):
             
         assert db_coin.name == item['name']
 
+@pytest.mark.django_db
+@patch("finances.tasks.os.getenv", return_value="fake_key")
+def test_crypto_refresh_upserts_by_coin_id(mock_getenv, fake_upstream, django_assert_max_num_queries):
+    """
+    Test that a refresh reconciles coins in a fixed number of queries: renamed coins keep their
+    row, coins stored under their ticker keep theirs, and fiat currencies are left alone.
+    """
+    with open("tests/coingecko_response.json", "r") as f:
+        coins = json.load(f)
+    Currency.objects.create(id="BTC", alpha_code="BTC", name="Bitcoin", rate=1)
+    Currency.objects.create(id="EUR", alpha_code="EUR", num_code=978, name="Euro", rate=45)
+    coins.append({"id": "EUR", "symbol": "eur", "name": "Euro Coin", "current_price": 44})
+    fake_upstream.routes["/coingecko/coins/markets"] = [(200, coins)]
+
+    with django_assert_max_num_queries(8):
+        fetch_crypto_rates()
+
+    bitcoin = next(coin for coin in coins if coin["id"] == "bitcoin")
+    assert Currency.objects.get(id="BTC").rate == Decimal(str(bitcoin["current_price"]))
+    assert not Currency.objects.filter(id="bitcoin").exists()
+    assert Currency.objects.get(id="EUR").rate == 45
+    assert Currency.objects.filter(alpha_code="USDC").count() > 1
+
+    coins[1] = {**coins[1], "name": "Renamed", "current_price": 1.5}
+    fake_upstream.routes["/coingecko/coins/markets"] = [(200, coins)]
+    fetch_crypto_rates()
+    renamed = Currency.objects.get(id=coins[1]["id"])
+    assert (renamed.name, renamed.rate) == ("Renamed", Decimal("1.5"))
+    assert Currency.objects.count() == len(coins) + 1  # and UAH
+
+
+@pytest.mark.django_db
+def test_fiat_refresh_upserts_in_a_few_queries(fake_upstream, caplog, django_assert_max_num_queries):
+    """
+    Test that a Monobank refresh stores every known currency in one upsert, without pycountry,
+    and reports the codes it had to skip.
+    """
+    Currency.objects.create(id="usd", alpha_code="USD", num_code=840, name="Dollar", rate=40)
+    fake_upstream.routes["/monobank/bank/currency"] = [(200, [
+        {"currencyCodeA": 840, "currencyCodeB": 980, "rateBuy": 41.1, "rateSell": 41.6},
+        {"currencyCodeA": 978, "currencyCodeB": 980, "rateCross": 48.25},
+        {"currencyCodeA": 978, "currencyCodeB": 840, "rateBuy": 1.16, "rateSell": 1.17},
+        {"currencyCodeA": 4, "currencyCodeB": 980, "rateCross": 0.5},
+    ])]
+
+    with patch.dict('sys.modules', {'pycountry': None}), django_assert_max_num_queries(5):
+        result = fetch_exchange_rates()
+
+    assert sorted(result['updated']) == ["EUR", "UAH", "usd"]
+    assert result['skipped'] == [{"code": 4, "reason": "unknown ISO 4217 code"}]
+    assert "Skipped 1 Monobank rate(s)" in caplog.text
+    usd = Currency.objects.get(alpha_code="USD")
+    assert (usd.pk, usd.name, usd.rate) == ("usd", "US Dollar", Decimal("41.1"))
+    assert Currency.objects.get(id="EUR").rate == Decimal("48.25")
+    assert Currency.objects.get(alpha_code="UAH").rate == 1
+
+
+@pytest.mark.django_db
+def test_refresh_records_only_rates_that_changed(fake_upstream):
+    fake_upstream.routes["/monobank/bank/currency"] = [
+        (200, [{"currencyCodeA": 840, "currencyCodeB": 980, "rateCross": 41.1},
+               {"currencyCodeA": 978, "currencyCodeB": 980, "rateCross": 48.25}]),
+        (200, [{"currencyCodeA": 840, "currencyCodeB": 980, "rateCross": 41.1},
+               {"currencyCodeA": 978, "currencyCodeB": 980, "rateCross": 48.5}]),
+    ]
+    fetch_exchange_rates()
+    assert CurrencyRate.objects.count() == 3
+
+    fetch_exchange_rates()
+    assert CurrencyRate.objects.count() == 4
+    assert list(CurrencyRate.objects.filter(currency_id="EUR").order_by('timestamp').values_list('rate', flat=True)) \
+        == [Decimal("48.25"), Decimal("48.5")]
+
+
 FAKE_MCC_MAPPING = {
     "5411": "Grocery Stores",
     "4121": "Taxicabs and Limousines",
@@ -46,6 +127,17 @@ FAKE_MCC_MAPPING = {
     "7372": "Computer Software Stores"
 }
 
+
+@contextmanager
+def fake_mcc_groups():
+    # The categorizer is built once per process, so it is rebuilt around the patched table
+    with patch('finances.categories.mcc_group_mapping', return_value=FAKE_MCC_MAPPING):
+        get_categorizer.cache_clear()
+        try:
+            yield
+        finally:
+            get_categorizer.cache_clear()
+
 @pytest.mark.django_db
 def test_import_monobank_from_file(user, balance):
     csv_path = Path(__file__).parent / "static" / "monobank_statement.csv"
@@ -55,7 +147,7 @@ def test_import_monobank_from_file(user, balance):
 
     file_obj = SimpleUploadedFile("test_statement.csv", file_content)
 
-    with patch.dict('finances.tasks.MCC_GROUP_MAPPING', FAKE_MCC_MAPPING):
+    with fake_mcc_groups():
         response = import_transaction_file(file_obj, user, balance)
 
     assert response['status'] == 'success'
@@ -70,4 +162,271 @@ def test_import_monobank_from_file(user, balance):
     assert t3.category == "Computer Software Stores"
 
     balance.refresh_from_db()
-    assert float(balance.amount) == 5000.00
\ No newline at end of file
+    assert float(balance.amount) == 5000.00
+
+@pytest.mark.django_db
+def test_import_in_chunks_matches_single_pass(user, balance):
+    """
+    Test that a statement split across many chunks imports the same rows and ends on the
+    running balance of its newest row, which only the first chunk sees.
+    """
+    csv_path = Path(__file__).parent / "static" / "monobank_statement.csv"
+    file_obj = SimpleUploadedFile("test_statement.csv", csv_path.read_bytes())
+
+    with fake_mcc_groups():
+        response = import_transaction_file(file_obj, user, balance, chunk_size=2)
+
+    assert response['count'] == 5
+    assert Transaction.objects.filter(balance=balance).count() == 5
+    assert Transaction.objects.get(amount=-500.00).category == "Computer Software Stores"
+    balance.refresh_from_db()
+    assert float(balance.amount) == 5000.00
+
+
+@pytest.mark.django_db
+def test_reimport_skips_rows_already_imported(user, balance):
+    """
+    Test that importing the same or an overlapping statement again adds only the new rows,
+    keeps identical rows within a statement apart, and leaves the balance alone.
+    """
+    csv_path = Path(__file__).parent / "static" / "monobank_statement.csv"
+    first = import_transaction_file(SimpleUploadedFile("statement.csv", csv_path.read_bytes()), user, balance)
+    assert (first['inserted'], first['skipped']) == (5, 0)
+
+    again = import_transaction_file(SimpleUploadedFile("statement.csv", csv_path.read_bytes()), user, balance,
+                                    chunk_size=2)
+    assert (again['inserted'], again['skipped']) == (0, 5)
+    assert Transaction.objects.filter(balance=balance).count() == 5
+
+    # An older statement that overlaps the first one by a row, plus a genuine twin of that row
+    header, *rows = csv_path.read_text(encoding='utf-8').splitlines()
+    older = [rows[-1], rows[-1],
+             '"01.12.2025 08:00:00",Bakery,5411,-40.00,-40.00,UAH,—,—,—,1000.00']
+    result = import_transaction_file(SimpleUploadedFile("older.csv", "\n".join([header, *older]).encode()),
+                                     user, balance)
+    assert (result['inserted'], result['skipped']) == (2, 1)
+    assert Transaction.objects.filter(balance=balance).count() == 7
+    balance.refresh_from_db()
+    assert float(balance.amount) == 5000.00
+
+
+
+@pytest.mark.django_db
+def test_failed_import_keeps_committed_chunks_and_resumes(user, balance):
+    """
+    Test that each chunk commits on its own: an import that fails halfway keeps the chunks
+    before the failure, and running it again adds only the rest and settles the balance.
+    """
+    csv_path = Path(__file__).parent / "static" / "monobank_statement.csv"
+    calls = []
+
+    def failing(balance, transactions):
+        calls.append(len(transactions))
+        if len(calls) == 2:
+            raise RuntimeError("disk full")
+        return insert_new(balance, transactions)
+
+    with patch('finances.tasks.insert_new', failing), pytest.raises(RuntimeError):
+        import_transaction_file(SimpleUploadedFile("statement.csv", csv_path.read_bytes()), user, balance,
+                                chunk_size=2)
+    assert Transaction.objects.filter(balance=balance).count() == 2
+
+    result = import_transaction_file(SimpleUploadedFile("statement.csv", csv_path.read_bytes()), user, balance,
+                                     chunk_size=2)
+    assert (result['inserted'], result['skipped']) == (3, 2)
+    assert Transaction.objects.filter(balance=balance).count() == 5
+    balance.refresh_from_db()
+    assert float(balance.amount) == 5000.00
+
+def test_categorizer_matches_mcc_groups_and_bank_names():
+    categorizer = get_categorizer()
+    column = pd.Series([5411, 742.0, None, '4121', 'Transport', 'Unknown', 99999], dtype=object)
+
+    assert list(categorizer.categorize_column(column)) == [
+        'Retail Outlet Services', 'Agricultural Services', 'Other', 'Transportation Services', 'Other', 'Other',
+        'Other']
+    assert list(categorizer.categorize_column(column, bank_names=True))[4] == 'Transportation Services'
+    assert categorizer.categorize_mccs([5411, None]) == ['Retail Outlet Services', 'Other']
+    assert get_categorizer() is categorizer
+
+
+@pytest.mark.django_db
+def test_monobank_sync_categorizes_by_mcc(fake_upstream, user, balance):
+    monobank_user = MonobankUser.objects.create(user=user, token="token")
+    MonobankBalance.objects.create(balance=balance, currency=balance.currency, name="black", user=monobank_user,
+                                   monobank_id="acc", amount=0)
+    fake_upstream.routes["/monobank/personal/statement/acc/0"] = [(200, [
+        {"id": "1", "time": 1765000000, "description": "Shop", "mcc": 5411, "amount": -10000},
+        {"id": "2", "time": 1765000100, "description": "Mystery", "mcc": 1, "amount": -500},
+    ])]
+
+    with fake_mcc_groups():
+        fetch_monobank_report("token", "acc", 0, user)
+
+    assert Transaction.objects.get(name="Shop").category == "Grocery Stores"
+    assert Transaction.objects.get(name="Mystery").category == "Other"
+
+
+@pytest.mark.django_db
+def test_monobank_sync_is_all_or_nothing(fake_upstream, user, balance):
+    """
+    Test that a sync adjusts the balance by the statement total and that a failure part way
+    through leaves neither transactions nor the adjustment behind.
+    """
+    monobank_user = MonobankUser.objects.create(user=user, token="token")
+    MonobankBalance.objects.create(balance=balance, currency=balance.currency, name="black", user=monobank_user,
+                                   monobank_id="acc", amount=0)
+    fake_upstream.routes["/monobank/personal/statement/acc/0"] = [(200, [
+        {"id": "1", "time": 1765000000, "description": "Shop", "mcc": 5411, "amount": -10050},
+        {"id": "2", "time": 1765000100, "description": "Salary", "mcc": 6011, "amount": 2500000},
+    ])]
+    starting_amount = Balance.objects.get(pk=balance.pk).amount
+
+    with patch('monobank.views.refresh_balance_snapshots', side_effect=RuntimeError):
+        with pytest.raises(RuntimeError):
+            fetch_monobank_report("token", "acc", 0, user, adjust_balance=True)
+    assert not Transaction.objects.exists()
+    assert Balance.objects.get(pk=balance.pk).amount == starting_amount
+
+    fetch_monobank_report("token", "acc", 0, user, adjust_balance=True)
+    assert Transaction.objects.count() == 2
+    assert Balance.objects.get(pk=balance.pk).amount == starting_amount + Decimal("24899.50")
+
+
+@pytest.mark.django_db
+def test_import_privatbank_xlsx_streams_rows(user, balance):
+    """
+    Test that a PrivatBank workbook (title line, header, rows newest first) imports through the
+    streaming reader, across chunk boundaries.
+    """
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(['Виписка з Ваших карток за період'])
+    sheet.append(['Дата', 'Категорія', 'Картка', 'Опис операції', 'Сума в валюті картки', 'Валюта картки',
+                  'Залишок на кінець періоду'])
+    sheet.append(['14.12.2025 12:30:15', 'Супермаркети та продукти', '5168', 'Silpo', -300.5, 'UAH', 1200.0])
+    sheet.append(['13.12.2025 10:00:00', 'Переказ на свою картку', '5168', 'To savings', -500, 'UAH', 1500.5])
+    sheet.append([None, None, None, None, None, None, None])
+    sheet.append(['12.12.2025 09:00:00', 'Невідома категорія', '5168', 'Salary', 2000, 'UAH', 2000.5])
+    content = io.BytesIO()
+    workbook.save(content)
+
+    file_obj = SimpleUploadedFile("statement.xlsx", content.getvalue())
+    result = import_transaction_file(file_obj, user, balance, chunk_size=2)
+
+    assert result['inserted'] == 3
+    assert Transaction.objects.get(name="Silpo").category == "Retail Outlet Services"
+    assert Transaction.objects.get(name="To savings").amount == Decimal("-500")
+    assert Transaction.objects.get(name="Salary").category == "Other"
+    balance.refresh_from_db()
+    assert float(balance.amount) == 1200.00
+
+
+def test_parser_detection_reads_only_the_head():
+    csv_path = Path(__file__).parent / "static" / "monobank_statement.csv"
+    head = csv_path.read_bytes()
+    reads = []
+
+    class Upload(io.BytesIO):
+        name = "statement.csv"
+
+        def read(self, size=-1):
+            reads.append(size)
+            return super().read(size)
+
+    big = Upload(head + b"\n".join([head.splitlines()[1]] * 100_000))
+    assert isinstance(detect_parser(big), MonobankCSV)
+    assert reads == [SNIFF_BYTES]
+    assert big.tell() == 0
+
+    assert isinstance(detect_parser(SimpleUploadedFile("export.csv", b"Date,Amount,Category\n")), GenericCSV)
+    assert detect_parser(SimpleUploadedFile("export.csv", b"when,how much\n")) is None
+    assert detect_parser(SimpleUploadedFile("statement.xlsx", b"not a zip")) is None
+
+    header_mapping.cache_clear()
+    for _ in range(3):
+        header_mapping(("Date and time", "MCC", "Balance"))
+    assert header_mapping.cache_info().hits == 2
+
+
+@pytest.mark.django_db
+def test_import_generic_csv_without_running_balance(user, balance):
+    content = "Date,Amount,Description,Category\n05.12.2025 10:00,-20.5,Coffee,5812\n04.12.2025 09:00,100,Gift,\n"
+    result = import_transaction_file(SimpleUploadedFile("export.csv", content.encode()), user, balance)
+
+    assert result['inserted'] == 2
+    assert Transaction.objects.get(name="Coffee").category == "Miscellaneous Stores"
+    balance.refresh_from_db()
+    assert balance.amount == Decimal("79.5")
+
+
+@pytest.mark.django_db
+def test_twins_apart_in_the_file_are_both_imported(user, balance):
+    content = ("Date,Amount,Description\n05.12.2025 10:00,-20,Coffee\n05.12.2025 10:00,100,Gift\n"
+               "05.12.2025 10:00,-20,Coffee\n")
+    result = import_transaction_file(SimpleUploadedFile("export.csv", content.encode()), user, balance)
+
+    assert result['inserted'] == 3
+    assert Transaction.objects.filter(balance=balance).count() == 3
+    assert CategoryRollup.objects.get(user=user).count == 3
+    balance.refresh_from_db()
+    assert balance.amount == Decimal(60)
+
+    again = import_transaction_file(SimpleUploadedFile("export.csv", content.encode()), user, balance)
+    assert (again['inserted'], again['skipped']) == (0, 3)
+
+
+
+@pytest.mark.django_db
+def test_twins_in_an_unsorted_statement_are_counted_across_chunks(user, balance):
+    """
+    Test that a statement going back to a timestamp it already left is recounted from the top,
+    so the twin gets its own fingerprint whatever the chunking, while a sorted one only ever
+    counts the rows at its current timestamp.
+    """
+    content = ("Date,Amount,Description\n05.12.2025 10:00,-20,Coffee\n04.12.2025 09:00,100,Gift\n"
+               "05.12.2025 10:00,-20,Coffee\n")
+    result = import_transaction_file(SimpleUploadedFile("export.csv", content.encode()), user, balance, chunk_size=1)
+    assert result['inserted'] == 3
+    fingerprints = set(Transaction.objects.values_list('fingerprint', flat=True))
+
+    # The same fingerprints when the whole statement is one chunk
+    chunks = read_transactions(SimpleUploadedFile("export.csv", content.encode()), user, balance)
+    assert {t.fingerprint for _, transactions, _ in chunks for t in transactions} == fingerprints
+
+    again = import_transaction_file(SimpleUploadedFile("export.csv", content.encode()), user, balance, chunk_size=2)
+    assert (again['inserted'], again['skipped']) == (0, 3)
+
+    twins = TwinCounter(replay=None)
+    assert [twins(minute, f"row at {minute}") for minute in [3, 2, 2, 1, 1, 0]] == [0, 0, 1, 0, 1, 0]
+    assert twins.sorted and len(twins.counts) == 1
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_imports_count_each_row_once(user, balance):
+    """
+    Test that two imports of the same statement racing each other store, count, roll up and
+    apply every row exactly once between them.
+    """
+    content = "Date,Amount,Description\n05.12.2025 10:00,-20,Coffee\n04.12.2025 09:00,100,Gift\n"
+    start = threading.Barrier(2)
+    results = []
+
+    def run():
+        try:
+            start.wait()
+            results.append(import_transaction_file(SimpleUploadedFile("export.csv", content.encode()), user,
+                                                   Balance.objects.get(pk=balance.pk)))
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert sorted(result['inserted'] for result in results) == [0, 2]
+    assert Transaction.objects.filter(balance=balance).count() == 2
+    assert sum(rollup.count for rollup in CategoryRollup.objects.filter(user=user)) == 2
+    balance.refresh_from_db()
+    assert balance.amount == Decimal(80)
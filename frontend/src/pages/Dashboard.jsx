@@ -64,7 +64,9 @@ export default function Dashboard() {
 
         formData.append('file', file)
 
-        const response = await fetch(backendUrl + `import/?balance_id=${balanceId}`, {
+        // A zip of statements goes to the archive endpoint and is imported as one job
+        const endpoint = file.name.toLowerCase().endsWith('.zip') ? 'import/archive/' : 'import/'
+        const response = await fetch(backendUrl + `${endpoint}?balance_id=${balanceId}`, {
             method: "POST",
             headers: {
                 'Authorization': 'Bearer ' + localStorage.getItem('access'),
@@ -73,10 +75,30 @@ export default function Dashboard() {
         })
 
         if (response.ok) {
+            const job = await response.json()
+            await waitForImport(job.id)
             refreshData()
         }
     }
 
+    async function waitForImport(jobId) {
+        // Imports run in the background; poll until the job has finished one way or the other
+        while (true) {
+            const response = await fetch(backendUrl + `import/${jobId}/`, {
+                headers: {
+                    'Authorization': 'Bearer ' + localStorage.getItem('access'),
+                },
+            })
+            if (!response.ok) return
+            const job = await response.json()
+            if (job.status === 'done' || job.status === 'failed') {
+                if (job.status === 'failed') console.error(job.error)
+                return
+            }
+            await new Promise((resolve) => setTimeout(resolve, 1000))
+        }
+    }
+
     async function handleDeleteBalance(event) {
         event.preventDefault()
 